@@ -1,10 +1,1863 @@
 import tkinter as tk
 from tkinter import messagebox
 import os
+import sys
 import pygame.mixer
 
 import numpy as np
 import random
+import time
+import threading
+import queue
+import traceback
+from array import array
+
+
+# Integer piece encoding: a side bit plus a type index.
+# Only the drawing code maps codes back to glyphs (PIECE_GLYPHS).
+EMPTY = 0
+GENERAL, ADVISOR, ELEPHANT, HORSE, CHARIOT, CANNON, PAWN = range(1, 8)
+PIECE_TYPE_MASK = 7
+RED = 8
+BLACK = 16
+SIDE_MASK = RED | BLACK
+OFFBOARD = 32  # Sentinel for padding squares: no side bits, never empty
+
+SIDE_FLAGS = {'red': RED, 'black': BLACK}
+
+PIECE_GLYPHS = {
+    RED | GENERAL: '帥', RED | ADVISOR: '仕', RED | ELEPHANT: '相', RED | HORSE: '馬',
+    RED | CHARIOT: '車', RED | CANNON: '炮', RED | PAWN: '兵',
+    BLACK | GENERAL: '將', BLACK | ADVISOR: '士', BLACK | ELEPHANT: '象', BLACK | HORSE: '馬',
+    BLACK | CHARIOT: '車', BLACK | CANNON: '炮', BLACK | PAWN: '卒',
+}
+
+# Material values indexed by piece type
+PIECE_VALUES = (
+    0,    # (empty)
+    0,    # General - valued at 0 since it can't be captured
+    200,  # Advisor
+    200,  # Elephant
+    450,  # Horse
+    900,  # Chariot - most valuable piece
+    450,  # Cannon
+    100,  # Pawn - base value, will get bonus when advanced
+)
+
+# Exchange values for static exchange evaluation: as PIECE_VALUES, but a general
+# outweighs any exchange, so it only ever captures last onto an undefended square
+SEE_VALUES = (0, 10000) + PIECE_VALUES[2:]
+
+# Order in which Board.least_valuable_attacker tries piece types, indexed by type:
+# pawn, advisor, elephant, horse, cannon, chariot, general
+ATTACKER_ORDER = (0, 6, 1, 2, 3, 5, 4, 0)
+
+
+# Padded 16x16 mailbox. Square (row, col) lives at (row + 3) * 16 + (col + 3);
+# every other cell holds OFFBOARD, so direction walks need no bounds checks.
+# Moves are plain ints: from_square << 8 | to_square.
+
+def square(row, col):
+    return (row + 3) << 4 | (col + 3)
+
+SQUARE_ROW = [(sq >> 4) - 3 for sq in range(256)]
+SQUARE_COL = [(sq & 15) - 3 for sq in range(256)]
+
+# On-board squares in row-major order; position i also gives the bitboard bit
+BOARD_SQUARES = tuple(square(row, col) for row in range(10) for col in range(9))
+SQUARE_BITS = [0] * 256
+SQUARE_INDEX = [-1] * 256  # Position in BOARD_SQUARES (the 90-entry board encoding)
+for _index, _sq in enumerate(BOARD_SQUARES):
+    SQUARE_BITS[_sq] = 1 << _index
+    SQUARE_INDEX[_sq] = _index
+
+EMPTY_MAILBOX = [OFFBOARD] * 256
+for _sq in BOARD_SQUARES:
+    EMPTY_MAILBOX[_sq] = EMPTY
+
+ORTHOGONAL_DELTAS = (-16, 16, -1, 1)
+KING_ZONE_DELTAS = (-17, -16, -15, -1, 0, 1, 15, 16, 17)
+
+UNDO_STACK_SIZE = 1024  # Initial undo stack depth (game plies plus search depth)
+
+# Zobrist keys: one 64-bit key per (piece code, square), indexed piece << 8 | square,
+# plus a key XORed in while black is to move. Fixed seed so keys are stable across runs.
+_zobrist_rng = random.Random(20241018)
+ZOBRIST_PIECES = [_zobrist_rng.getrandbits(64) for _ in range(24 << 8)]
+ZOBRIST_SIDE = _zobrist_rng.getrandbits(64)
+
+
+# FEN piece letters (upper case for red); 'h'/'e' are accepted as horse/elephant aliases
+FEN_PIECES = {'k': GENERAL, 'a': ADVISOR, 'b': ELEPHANT, 'e': ELEPHANT, 'n': HORSE,
+              'h': HORSE, 'r': CHARIOT, 'c': CANNON, 'p': PAWN}
+FEN_LETTERS = {GENERAL: 'k', ADVISOR: 'a', ELEPHANT: 'b', HORSE: 'n',
+               CHARIOT: 'r', CANNON: 'c', PAWN: 'p'}
+
+# Same position as ChineseChess.setup_pieces
+START_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w - - 0 1'
+
+
+def move_notation(move):
+    """ICCS coordinates for a move, e.g. 'h2e2' (files a-i from red's left, ranks 0-9 from red's side)"""
+    from_sq, to_sq = move >> 8, move & 255
+    return (f"{'abcdefghi'[SQUARE_COL[from_sq]]}{9 - SQUARE_ROW[from_sq]}"
+            f"{'abcdefghi'[SQUARE_COL[to_sq]]}{9 - SQUARE_ROW[to_sq]}")
+
+
+def mvv_lva(squares, move):
+    """Capture ordering key: most valuable victim first, then least valuable attacker"""
+    return (PIECE_VALUES[squares[move & 255] & PIECE_TYPE_MASK] * 10
+            - PIECE_VALUES[squares[move >> 8] & PIECE_TYPE_MASK])
+
+
+# Precomputed step tables, built once at import and indexed by square.
+# Tables for pieces whose rules depend on the palace or the river are split by
+# side (RED / BLACK).
+# HORSE_MOVES / ELEPHANT_MOVES map each destination to its blocking leg / eye square.
+# ADVISOR_MOVES / GENERAL_MOVES / PAWN_MOVES hold plain destination tuples.
+
+def _on_board(row, col):
+    return 0 <= row < 10 and 0 <= col < 9
+
+def _in_palace(side, row, col):
+    if side == RED:
+        return 7 <= row <= 9 and 3 <= col <= 5
+    return 0 <= row <= 2 and 3 <= col <= 5
+
+def _build_step_tables():
+    horse = [{} for _ in range(256)]
+    elephant = {side: [{} for _ in range(256)] for side in (RED, BLACK)}
+    advisor = {side: [() for _ in range(256)] for side in (RED, BLACK)}
+    general = {side: [() for _ in range(256)] for side in (RED, BLACK)}
+    pawn = {side: [() for _ in range(256)] for side in (RED, BLACK)}
+
+    for row in range(10):
+        for col in range(9):
+            sq = square(row, col)
+
+            # Horse: two steps one way, one step the other, blocked at the leg
+            for dr, dc in ((-2, -1), (-2, 1), (2, -1), (2, 1),
+                           (-1, -2), (1, -2), (-1, 2), (1, 2)):
+                if _on_board(row + dr, col + dc):
+                    if abs(dr) == 2:
+                        leg = square(row + dr // 2, col)
+                    else:
+                        leg = square(row, col + dc // 2)
+                    horse[sq][square(row + dr, col + dc)] = leg
+
+            for side in (RED, BLACK):
+                # Elephant: two steps diagonally, blocked at the eye, never across the river
+                for dr, dc in ((-2, -2), (-2, 2), (2, -2), (2, 2)):
+                    r, c = row + dr, col + dc
+                    if _on_board(r, c) and (r >= 5 if side == RED else r <= 4):
+                        elephant[side][sq][square(r, c)] = square(row + dr // 2, col + dc // 2)
+
+                # Advisor and general: one step inside the palace
+                advisor[side][sq] = tuple(
+                    square(row + dr, col + dc)
+                    for dr, dc in ((-1, -1), (-1, 1), (1, -1), (1, 1))
+                    if _in_palace(side, row + dr, col + dc))
+                general[side][sq] = tuple(
+                    square(row + dr, col + dc)
+                    for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1))
+                    if _in_palace(side, row + dr, col + dc))
+
+                # Pawn: forward, plus sideways once across the river
+                forward = -1 if side == RED else 1
+                crossed_river = row <= 4 if side == RED else row >= 5
+                steps = [(row + forward, col)]
+                if crossed_river:
+                    steps += [(row, col - 1), (row, col + 1)]
+                pawn[side][sq] = tuple(square(r, c) for r, c in steps if _on_board(r, c))
+
+    return horse, elephant, advisor, general, pawn
+
+HORSE_MOVES, ELEPHANT_MOVES, ADVISOR_MOVES, GENERAL_MOVES, PAWN_MOVES = _build_step_tables()
+
+# Step tables for the pieces that only move one point, indexed by piece type
+STEP_MOVES = {ADVISOR: ADVISOR_MOVES, GENERAL: GENERAL_MOVES, PAWN: PAWN_MOVES}
+
+# Reversed step tables for attack detection: TABLE[target] lists the squares a
+# piece could attack target from (with the blocking square for horse/elephant).
+
+def _reverse_blocked(table):
+    reverse = [{} for _ in range(256)]
+    for from_sq in BOARD_SQUARES:
+        for to_sq, blocker in table[from_sq].items():
+            reverse[to_sq][from_sq] = blocker
+    return reverse
+
+def _reverse_steps(table):
+    reverse = [[] for _ in range(256)]
+    for from_sq in BOARD_SQUARES:
+        for to_sq in table[from_sq]:
+            reverse[to_sq].append(from_sq)
+    return [tuple(sources) for sources in reverse]
+
+HORSE_ATTACKS = _reverse_blocked(HORSE_MOVES)
+ELEPHANT_ATTACKS = {side: _reverse_blocked(ELEPHANT_MOVES[side]) for side in (RED, BLACK)}
+ADVISOR_ATTACKS = {side: _reverse_steps(ADVISOR_MOVES[side]) for side in (RED, BLACK)}
+GENERAL_ATTACKS = {side: _reverse_steps(GENERAL_MOVES[side]) for side in (RED, BLACK)}
+PAWN_ATTACKS = {side: _reverse_steps(PAWN_MOVES[side]) for side in (RED, BLACK)}
+
+
+# Bitboard tables. Bit (row * 9 + col) stands for square (row, col).
+
+def _slide_masks(pos, occupancy, length):
+    """
+    Rays from pos along one rank or file for the given occupancy.
+    Returns (ray, screen_hits): ray covers every square up to and including the
+    first blocker; screen_hits holds the first piece behind each blocker.
+    """
+    ray = screen_hits = 0
+    for step in (-1, 1):
+        i = pos + step
+        screened = False
+        while 0 <= i < length:
+            if not screened:
+                ray |= 1 << i
+                if occupancy >> i & 1:
+                    screened = True
+            elif occupancy >> i & 1:
+                screen_hits |= 1 << i
+                break
+            i += step
+    return ray, screen_hits
+
+def _build_bitboard_tables():
+    # Rank rays are 9-bit masks shifted by row * 9 at use
+    rank_rays = [[0] * 512 for _ in range(9)]
+    rank_screens = [[0] * 512 for _ in range(9)]
+    for col in range(9):
+        for occupancy in range(512):
+            rank_rays[col][occupancy], rank_screens[col][occupancy] = \
+                _slide_masks(col, occupancy, 9)
+
+    # File rays are stored spread out (bit r -> bit r * 9) and shifted by col at use
+    def spread(mask):
+        return sum(1 << (r * 9) for r in range(10) if mask >> r & 1)
+
+    file_rays = [[0] * 1024 for _ in range(10)]
+    file_screens = [[0] * 1024 for _ in range(10)]
+    for row in range(10):
+        for occupancy in range(1024):
+            ray, screen_hits = _slide_masks(row, occupancy, 10)
+            file_rays[row][occupancy] = spread(ray)
+            file_screens[row][occupancy] = spread(screen_hits)
+
+    return rank_rays, rank_screens, file_rays, file_screens
+
+RANK_RAYS, RANK_SCREENS, FILE_RAYS, FILE_SCREENS = _build_bitboard_tables()
+
+
+# Piece-square tables: positional bonus for one piece on each point, written from
+# red's side of the board (row 0 is black's back rank, row 9 is red's) as 90
+# row-major entries. These are plain data, meant to be tuned.
+PIECE_SQUARE_TABLES = {
+    GENERAL: (
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0, -20, -20, -20,   0,   0,   0,
+          0,   0,   0, -10, -10, -10,   0,   0,   0,
+          0,   0,   0,  -5,   0,  -5,   0,   0,   0,
+    ),
+    ADVISOR: (
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,  10,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+    ),
+    ELEPHANT: (
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,  -5,   0,   0,   0,  -5,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,  10,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+    ),
+    # Horse, chariot and cannon: center files and penetration
+    HORSE: (
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+    ),
+    CHARIOT: (
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+    ),
+    CANNON: (
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+         50,  50,  70,  70,  70,  70,  70,  50,  50,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+          0,   0,  20,  20,  20,  20,  20,   0,   0,
+    ),
+    # Pawns: a jump for crossing the river, then more for each step forward
+    PAWN: (
+        150, 150, 150, 150, 150, 150, 150, 150, 150,
+        130, 130, 130, 130, 130, 130, 130, 130, 130,
+        110, 110, 110, 110, 110, 110, 110, 110, 110,
+         90,  90,  90,  90,  90,  90,  90,  90,  90,
+         70,  70,  70,  70,  70,  70,  70,  70,  70,
+         40,  40,  40,  40,  40,  40,  40,  40,  40,
+         30,  30,  30,  30,  30,  30,  30,  30,  30,
+         20,  20,  20,  20,  20,  20,  20,  20,  20,
+         10,  10,  10,  10,  10,  10,  10,  10,  10,
+          0,   0,   0,   0,   0,   0,   0,   0,   0,
+    ),
+}
+
+# Flat lookup indexed piece << 8 | square, scored for the piece's own side. Red
+# reads the tables as written; black reads them rotated half a turn.
+def _build_piece_square_scores():
+    scores = [0] * (24 << 8)
+    for piece_type, table in PIECE_SQUARE_TABLES.items():
+        for index, sq in enumerate(BOARD_SQUARES):
+            scores[(RED | piece_type) << 8 | sq] = table[index]
+            scores[(BLACK | piece_type) << 8 | sq] = table[89 - index]
+    return scores
+
+PIECE_SQUARE_SCORES = _build_piece_square_scores()
+
+
+# Batch evaluation with NumPy. A position is encoded as a row of 90 int8 piece
+# codes in BOARD_SQUARES order (see Board.encode). BATCH_EVAL_TABLE[piece, index]
+# is material plus piece-square score, positive for black like the search's
+# evaluation, so a whole array of positions is scored with one fancy-index and sum.
+def _build_batch_eval_table():
+    table = np.zeros((24, 90), dtype=np.int32)
+    for side, sign in ((RED, -1), (BLACK, 1)):
+        for piece_type in range(GENERAL, PAWN + 1):
+            piece = side | piece_type
+            for index, sq in enumerate(BOARD_SQUARES):
+                table[piece, index] = sign * (PIECE_VALUES[piece_type] + PIECE_SQUARE_SCORES[piece << 8 | sq])
+    return table
+
+BATCH_EVAL_TABLE = _build_batch_eval_table()
+BATCH_COLUMNS = np.arange(90)
+
+def evaluate_batch(positions):
+    """
+    Static material plus piece-square score of every row of an (N, 90) int8 array
+    of encoded positions, as an (N,) int array. Matches the board's running
+    material/pst sums; the dynamic terms of the search's evaluation are left out.
+    """
+    return BATCH_EVAL_TABLE[positions.astype(np.intp), BATCH_COLUMNS].sum(axis=1)
+
+
+class Board:
+    """
+    Engine position: a padded 16x16 mailbox of piece codes, plus a Python-int
+    bitboard per piece and per-rank/per-file occupancy masks so
+    chariot and cannon rays can also come straight from lookup tables.
+    King squares and a piece list per side are kept up to date by add_piece and
+    remove_piece, so locating the generals or walking one side's pieces never
+    scans the board.
+    make_move/unmake_move record each move on a preallocated undo stack; every
+    search and rules path goes through them so incremental state can't drift.
+    key is the Zobrist hash of the position, updated with every piece change, and
+    material/pst keep each side's material and piece-square score the same way.
+    piece_at/to_grid/from_grid adapt it to the (row, col) view used by the Tk code.
+    """
+
+    def __init__(self):
+        self.squares = EMPTY_MAILBOX[:]
+        self.side = RED  # Side to move
+        self.key = 0  # Zobrist hash, includes ZOBRIST_SIDE when black is to move
+        self.material = {RED: 0, BLACK: 0}  # Sum of PIECE_VALUES per side
+        self.pst = {RED: 0, BLACK: 0}  # Sum of PIECE_SQUARE_SCORES per side
+        self.king_squares = {RED: None, BLACK: None}
+        self.piece_squares = {RED: set(), BLACK: set()}  # Occupied squares per side
+        self.pieces = [0] * 24  # Indexed by piece code
+        self.rank_occupancy = [0] * 10  # bit col set if (row, col) is occupied
+        self.file_occupancy = [0] * 9   # bit row set if (row, col) is occupied
+
+        # Undo stack as parallel preallocated arrays indexed by ply
+        self.ply = 0
+        self.undo_moves = [0] * UNDO_STACK_SIZE
+        self.undo_captured = [EMPTY] * UNDO_STACK_SIZE
+        self.undo_keys = [0] * UNDO_STACK_SIZE  # Position key before each move
+
+    @classmethod
+    def from_grid(cls, grid, side=RED):
+        board = cls()
+        for row in range(10):
+            for col in range(9):
+                if grid[row][col]:
+                    board.add_piece(square(row, col), grid[row][col])
+        if side == BLACK:
+            board.side = BLACK
+            board.key ^= ZOBRIST_SIDE
+        return board
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        board = cls()
+        for row, rank in enumerate(fields[0].split('/')):
+            col = 0
+            for char in rank:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    side = RED if char.isupper() else BLACK
+                    board.add_piece(square(row, col), side | FEN_PIECES[char.lower()])
+                    col += 1
+        if len(fields) > 1 and fields[1] == 'b':
+            board.side = BLACK
+            board.key ^= ZOBRIST_SIDE
+        return board
+
+    def to_fen(self):
+        ranks = []
+        for row in range(10):
+            rank = ''
+            empty = 0
+            for col in range(9):
+                piece = self.piece_at(row, col)
+                if not piece:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                letter = FEN_LETTERS[piece & PIECE_TYPE_MASK]
+                rank += letter.upper() if piece & RED else letter
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        return f"{'/'.join(ranks)} {'w' if self.side == RED else 'b'} - - 0 1"
+
+    def encode(self):
+        """The position as 90 int8 piece codes in BOARD_SQUARES order, for evaluate_batch"""
+        return np.array([self.squares[sq] for sq in BOARD_SQUARES], dtype=np.int8)
+
+    def encode_moves(self, moves):
+        """(len(moves), 90) array of the positions after each move, built without making them"""
+        positions = np.tile(self.encode(), (len(moves), 1))
+        rows = np.arange(len(moves))
+        from_index = [SQUARE_INDEX[move >> 8] for move in moves]
+        positions[rows, [SQUARE_INDEX[move & 255] for move in moves]] = positions[rows, from_index]
+        positions[rows, from_index] = EMPTY
+        return positions
+
+    def to_grid(self):
+        return [[self.squares[square(row, col)] for col in range(9)] for row in range(10)]
+
+    def piece_at(self, row, col):
+        return self.squares[square(row, col)]
+
+    def add_piece(self, sq, piece):
+        bit = SQUARE_BITS[sq]
+        row, col = SQUARE_ROW[sq], SQUARE_COL[sq]
+        side = piece & SIDE_MASK
+        self.squares[sq] = piece
+        self.key ^= ZOBRIST_PIECES[piece << 8 | sq]
+        self.material[side] += PIECE_VALUES[piece & PIECE_TYPE_MASK]
+        self.pst[side] += PIECE_SQUARE_SCORES[piece << 8 | sq]
+        if piece & PIECE_TYPE_MASK == GENERAL:
+            self.king_squares[side] = sq
+        self.piece_squares[side].add(sq)
+        self.pieces[piece] |= bit
+        self.rank_occupancy[row] |= 1 << col
+        self.file_occupancy[col] |= 1 << row
+
+    def remove_piece(self, sq):
+        piece = self.squares[sq]
+        bit = SQUARE_BITS[sq]
+        row, col = SQUARE_ROW[sq], SQUARE_COL[sq]
+        side = piece & SIDE_MASK
+        self.squares[sq] = EMPTY
+        self.key ^= ZOBRIST_PIECES[piece << 8 | sq]
+        self.material[side] -= PIECE_VALUES[piece & PIECE_TYPE_MASK]
+        self.pst[side] -= PIECE_SQUARE_SCORES[piece << 8 | sq]
+        if piece & PIECE_TYPE_MASK == GENERAL:
+            self.king_squares[side] = None
+        self.piece_squares[side].discard(sq)
+        self.pieces[piece] ^= bit
+        self.rank_occupancy[row] ^= 1 << col
+        self.file_occupancy[col] ^= 1 << row
+        return piece
+
+    def make_move(self, move):
+        """Play a move, push it on the undo stack and return the captured piece (or EMPTY)"""
+        to_sq = move & 255
+        captured = self.squares[to_sq]
+
+        ply = self.ply
+        if ply == len(self.undo_moves):
+            self.undo_moves.extend([0] * UNDO_STACK_SIZE)
+            self.undo_captured.extend([EMPTY] * UNDO_STACK_SIZE)
+            self.undo_keys.extend([0] * UNDO_STACK_SIZE)
+        self.undo_moves[ply] = move
+        self.undo_captured[ply] = captured
+        self.undo_keys[ply] = self.key
+        self.ply = ply + 1
+        self.side ^= SIDE_MASK
+        self.key ^= ZOBRIST_SIDE
+
+        if captured:
+            self.remove_piece(to_sq)
+        self.add_piece(to_sq, self.remove_piece(move >> 8))
+        return captured
+
+    def unmake_move(self):
+        """Take back the last move made with make_move"""
+        ply = self.ply - 1
+        self.ply = ply
+        self.side ^= SIDE_MASK
+        move = self.undo_moves[ply]
+        captured = self.undo_captured[ply]
+
+        to_sq = move & 255
+        self.add_piece(move >> 8, self.remove_piece(to_sq))
+        if captured:
+            self.add_piece(to_sq, captured)
+        self.key = self.undo_keys[ply]
+
+    def make_null_move(self):
+        """Pass the turn without moving (for null-move pruning); undo with unmake_null_move"""
+        ply = self.ply
+        if ply == len(self.undo_moves):
+            self.undo_moves.extend([0] * UNDO_STACK_SIZE)
+            self.undo_captured.extend([EMPTY] * UNDO_STACK_SIZE)
+            self.undo_keys.extend([0] * UNDO_STACK_SIZE)
+        self.undo_moves[ply] = 0
+        self.undo_captured[ply] = EMPTY
+        self.undo_keys[ply] = self.key
+        self.ply = ply + 1
+        self.side ^= SIDE_MASK
+        self.key ^= ZOBRIST_SIDE
+
+    def unmake_null_move(self):
+        self.ply -= 1
+        self.side ^= SIDE_MASK
+        self.key = self.undo_keys[self.ply]
+
+    def copy(self):
+        """Independent copy of the position and its undo stack, e.g. for a search in another thread"""
+        board = Board.__new__(Board)
+        board.squares = self.squares[:]
+        board.side = self.side
+        board.key = self.key
+        board.material = dict(self.material)
+        board.pst = dict(self.pst)
+        board.king_squares = dict(self.king_squares)
+        board.piece_squares = {side: set(squares) for side, squares in self.piece_squares.items()}
+        board.pieces = self.pieces[:]
+        board.rank_occupancy = self.rank_occupancy[:]
+        board.file_occupancy = self.file_occupancy[:]
+        board.ply = self.ply
+        board.undo_moves = self.undo_moves[:]
+        board.undo_captured = self.undo_captured[:]
+        board.undo_keys = self.undo_keys[:]
+        return board
+
+    def unwind(self, ply):
+        """Take back moves and null moves until the undo stack is back at ply"""
+        while self.ply > ply:
+            if self.undo_moves[self.ply - 1]:
+                self.unmake_move()
+            else:
+                self.unmake_null_move()
+
+    def is_repetition(self):
+        """
+        True if the current position already occurred with the same side to move.
+        Looks back only to the last capture or null move; nothing before one can recur.
+        """
+        key = self.key
+        undo_moves, undo_captured, undo_keys = self.undo_moves, self.undo_captured, self.undo_keys
+        for ply in range(self.ply - 1, -1, -1):
+            if not undo_moves[ply] or undo_captured[ply] != EMPTY:
+                return False
+            # The key includes the side to move, so only same-side positions match
+            if undo_keys[ply] == key:
+                return True
+        return False
+
+    def chariot_targets(self, sq):
+        """Bitboard a chariot on sq reaches, including the first blocker on each ray"""
+        row, col = SQUARE_ROW[sq], SQUARE_COL[sq]
+        return (RANK_RAYS[col][self.rank_occupancy[row]] << (row * 9)
+                | FILE_RAYS[row][self.file_occupancy[col]] << col)
+
+    def cannon_captures(self, sq):
+        """Bitboard a cannon on sq could capture on by jumping one screen"""
+        row, col = SQUARE_ROW[sq], SQUARE_COL[sq]
+        return (RANK_SCREENS[col][self.rank_occupancy[row]] << (row * 9)
+                | FILE_SCREENS[row][self.file_occupancy[col]] << col)
+
+    def add_piece_moves(self, sq, moves):
+        """Append the pseudo-legal moves of the piece on sq to moves"""
+        squares = self.squares
+        piece = squares[sq]
+        side, piece_type = piece & SIDE_MASK, piece & PIECE_TYPE_MASK
+        opponent = side ^ SIDE_MASK
+        base = sq << 8
+
+        if piece_type == CHARIOT or piece_type == CANNON:
+            for delta in ORTHOGONAL_DELTAS:
+                to_sq = sq + delta
+                while squares[to_sq] == EMPTY:
+                    moves.append(base | to_sq)
+                    to_sq += delta
+                if piece_type == CHARIOT:
+                    if squares[to_sq] & opponent:
+                        moves.append(base | to_sq)
+                elif squares[to_sq] != OFFBOARD:
+                    # Jump the screen and capture the first piece behind it
+                    to_sq += delta
+                    while squares[to_sq] == EMPTY:
+                        to_sq += delta
+                    if squares[to_sq] & opponent:
+                        moves.append(base | to_sq)
+
+        elif piece_type == HORSE or piece_type == ELEPHANT:
+            table = HORSE_MOVES if piece_type == HORSE else ELEPHANT_MOVES[side]
+            for to_sq, blocker in table[sq].items():
+                # Horse leg / elephant eye must be empty
+                if squares[blocker] == EMPTY and not squares[to_sq] & side:
+                    moves.append(base | to_sq)
+
+        else:
+            for to_sq in STEP_MOVES[piece_type][side][sq]:
+                if not squares[to_sq] & side:
+                    moves.append(base | to_sq)
+
+    def get_piece_moves(self, sq):
+        """Destination squares reachable by the piece on sq"""
+        moves = []
+        self.add_piece_moves(sq, moves)
+        return [move & 255 for move in moves]
+
+    def generate_moves(self, side):
+        """All pseudo-legal moves for side (RED or BLACK)"""
+        moves = []
+        for sq in self.piece_squares[side]:
+            self.add_piece_moves(sq, moves)
+        return moves
+
+    def generate_legal_moves(self, side):
+        """
+        All legal moves for side (moves that don't leave its general in check).
+        Pins and check evasions are worked out from the king's four rays and the
+        horse legs around it; only king moves and moves touching those squares
+        are verified by playing them.
+        """
+        moves = self.generate_moves(side)
+        king_sq = self.king_squares[side]
+        if king_sq is None or self.king_squares[side ^ SIDE_MASK] is None:
+            return moves  # is_in_check never reports check without both generals
+
+        squares = self.squares
+        opponent = side ^ SIDE_MASK
+        in_check = self.is_in_check(side)
+        verify_from = set()  # Pieces that may be pinned
+        verify_to = set()    # Squares where a new piece may become a cannon screen
+
+        for delta in ORTHOGONAL_DELTAS:
+            # Squares along the ray up to and including the third piece
+            ray = []
+            blockers = []
+            sq = king_sq + delta
+            while squares[sq] != OFFBOARD:
+                ray.append(sq)
+                if squares[sq]:
+                    blockers.append(sq)
+                    if len(blockers) == 3:
+                        break
+                sq += delta
+
+            if in_check:
+                # Evasions along the ray: capture, block, or move a screen away
+                verify_from.update(ray)
+                verify_to.update(ray)
+                continue
+
+            first, second, third = [squares[b] for b in blockers] + [EMPTY] * (3 - len(blockers))
+            general = opponent | GENERAL if delta == 16 or delta == -16 else -1
+            # Leaving the ray uncovers a chariot, the flying general or a cannon behind a screen
+            if second == opponent | CHARIOT or second == general or third == opponent | CANNON:
+                verify_from.add(blockers[0])
+            if third == opponent | CANNON:
+                verify_from.add(blockers[1])
+            # A piece dropped in front of an enemy cannon becomes its screen
+            if first == opponent | CANNON:
+                verify_to.update(ray[:-1])
+
+        horse = opponent | HORSE
+        for horse_sq, leg in HORSE_ATTACKS[king_sq].items():
+            if in_check:
+                verify_from.update((horse_sq, leg))
+                verify_to.update((horse_sq, leg))
+            elif squares[horse_sq] == horse and squares[leg] & side:
+                verify_from.add(leg)  # Moving off the leg uncovers the horse
+        if in_check:
+            verify_to.update(PAWN_ATTACKS[opponent][king_sq])
+            # Taking the enemy general also ends the check as is_in_check sees it
+            verify_to.add(self.king_squares[opponent])
+
+        legal = []
+        for move in moves:
+            from_sq = move >> 8
+            if from_sq != king_sq and from_sq not in verify_from and (move & 255) not in verify_to:
+                if not in_check:
+                    legal.append(move)
+                # In check, a move touching none of those squares can't be an evasion
+                continue
+            self.make_move(move)
+            if not self.is_in_check(side):
+                legal.append(move)
+            self.unmake_move()
+        return legal
+
+    def perft(self, depth):
+        """Count the leaf nodes of the legal move tree from the side to move"""
+        if depth <= 0:
+            return 1
+        moves = self.generate_legal_moves(self.side)
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+        return nodes
+
+    def divide(self, depth):
+        """perft split by root move: {move: leaf count}"""
+        if depth < 1:
+            raise ValueError(f"divide depth must be at least 1, got {depth}")
+        counts = {}
+        for move in self.generate_legal_moves(self.side):
+            self.make_move(move)
+            counts[move] = self.perft(depth - 1)
+            self.unmake_move()
+        return counts
+
+    # Piece movement validation (8 functions)
+
+    def is_valid_move(self, from_sq, to_sq):
+        piece = self.squares[from_sq]
+        target = self.squares[to_sq]
+        
+        # Basic validation
+        if target == OFFBOARD:
+            return False
+            
+        # Can't capture own pieces
+        if target & piece & SIDE_MASK:
+            return False
+        
+        # Check specific piece movement rules (validator table indexed by piece type)
+        return self.move_validators[piece & PIECE_TYPE_MASK](self, from_sq, to_sq)
+
+    def is_valid_general_move(self, from_sq, to_sq):
+        # One step horizontally or vertically, staying inside the palace
+        return to_sq in GENERAL_MOVES[self.squares[from_sq] & SIDE_MASK][from_sq]
+
+    def is_valid_advisor_move(self, from_sq, to_sq):
+        # One step diagonally, staying inside the palace
+        return to_sq in ADVISOR_MOVES[self.squares[from_sq] & SIDE_MASK][from_sq]
+
+    def is_valid_elephant_move(self, from_sq, to_sq):
+        # Two steps diagonally without crossing the river
+        eye = ELEPHANT_MOVES[self.squares[from_sq] & SIDE_MASK][from_sq].get(to_sq)
+        if eye is None:
+            return False
+        
+        # Check if there's a piece blocking the elephant's path
+        return self.squares[eye] == EMPTY
+
+    def is_valid_horse_move(self, from_sq, to_sq):
+        # Must move in an L-shape (2 steps in one direction, 1 step in perpendicular direction)
+        leg = HORSE_MOVES[from_sq].get(to_sq)
+        if leg is None:
+            return False
+        
+        # Check for blocking piece
+        return self.squares[leg] == EMPTY
+
+    def _pieces_between(self, from_sq, to_sq):
+        """Count pieces strictly between two squares on the same rank or file"""
+        if SQUARE_ROW[from_sq] == SQUARE_ROW[to_sq]:
+            delta = 1 if to_sq > from_sq else -1
+        else:
+            delta = 16 if to_sq > from_sq else -16
+        count = 0
+        sq = from_sq + delta
+        while sq != to_sq:
+            if self.squares[sq]:
+                count += 1
+            sq += delta
+        return count
+
+    def is_valid_chariot_move(self, from_sq, to_sq):
+        # Must move horizontally or vertically
+        if SQUARE_ROW[from_sq] != SQUARE_ROW[to_sq] and SQUARE_COL[from_sq] != SQUARE_COL[to_sq]:
+            return False
+        
+        # Check if path is clear
+        return self._pieces_between(from_sq, to_sq) == 0
+
+    def is_valid_cannon_move(self, from_sq, to_sq):
+        # Must move horizontally or vertically
+        if SQUARE_ROW[from_sq] != SQUARE_ROW[to_sq] and SQUARE_COL[from_sq] != SQUARE_COL[to_sq]:
+            return False
+        
+        # If capturing, need exactly one piece between
+        if self.squares[to_sq]:
+            return self._pieces_between(from_sq, to_sq) == 1
+        # If not capturing, path must be clear
+        return self._pieces_between(from_sq, to_sq) == 0
+
+    def is_valid_pawn_move(self, from_sq, to_sq):
+        # Forward only before crossing the river, forward or sideways after
+        return to_sq in PAWN_MOVES[self.squares[from_sq] & SIDE_MASK][from_sq]
+
+    # Move validators indexed by piece type, used by is_valid_move
+    move_validators = (
+        None,
+        is_valid_general_move,
+        is_valid_advisor_move,
+        is_valid_elephant_move,
+        is_valid_horse_move,
+        is_valid_chariot_move,
+        is_valid_cannon_move,
+        is_valid_pawn_move,
+    )
+
+    # Check detection
+
+    def find_kings(self):
+        """Squares of both kings/generals (tracked incrementally)"""
+        return self.king_squares[RED], self.king_squares[BLACK]
+
+    def is_position_under_attack(self, sq, attacking_side):
+        """
+        Check if a square is under attack by pieces of the given side.
+        Works outward from the square: chariot rays and cannon screens come from
+        the occupancy tables, the other pieces from the reversed step tables.
+        """
+        squares = self.squares
+        
+        # A piece never attacks a square held by its own side
+        if squares[sq] & attacking_side:
+            return False
+        
+        pieces = self.pieces
+        rays = self.chariot_targets(sq)
+        if rays & pieces[attacking_side | CHARIOT]:
+            return True
+        # Like is_valid_move, a cannon reaches an empty square along a clear ray
+        # and an occupied one by jumping exactly one screen
+        cannon_reach = rays if squares[sq] == EMPTY else self.cannon_captures(sq)
+        if cannon_reach & pieces[attacking_side | CANNON]:
+            return True
+        
+        # Horse attacks use the leg next to the horse, not next to the target
+        horse = attacking_side | HORSE
+        for from_sq, leg in HORSE_ATTACKS[sq].items():
+            if squares[from_sq] == horse and squares[leg] == EMPTY:
+                return True
+        
+        pawn = attacking_side | PAWN
+        for from_sq in PAWN_ATTACKS[attacking_side][sq]:
+            if squares[from_sq] == pawn:
+                return True
+        
+        general = attacking_side | GENERAL
+        for from_sq in GENERAL_ATTACKS[attacking_side][sq]:
+            if squares[from_sq] == general:
+                return True
+        
+        advisor = attacking_side | ADVISOR
+        for from_sq in ADVISOR_ATTACKS[attacking_side][sq]:
+            if squares[from_sq] == advisor:
+                return True
+        
+        elephant = attacking_side | ELEPHANT
+        for from_sq, eye in ELEPHANT_ATTACKS[attacking_side][sq].items():
+            if squares[from_sq] == elephant and squares[eye] == EMPTY:
+                return True
+        
+        return False
+
+    def scan_position_under_attack(self, sq, attacking_side):
+        """Reference attack test: try is_valid_move from every attacking piece"""
+        for from_sq in self.piece_squares[attacking_side]:
+            # Check if this piece can move to the target square
+            if self.is_valid_move(from_sq, sq):
+                return True
+        return False
+
+    def least_valuable_attacker(self, sq, side):
+        """
+        Square of the cheapest piece of side that can move to sq by the piece rules
+        (pins ignored), or None. Reads only the mailbox, so see() can vacate squares
+        while it plays out an exchange.
+        """
+        squares = self.squares
+        pawn = side | PAWN
+        for from_sq in PAWN_ATTACKS[side][sq]:
+            if squares[from_sq] == pawn:
+                return from_sq
+        advisor = side | ADVISOR
+        for from_sq in ADVISOR_ATTACKS[side][sq]:
+            if squares[from_sq] == advisor:
+                return from_sq
+        elephant = side | ELEPHANT
+        for from_sq, eye in ELEPHANT_ATTACKS[side][sq].items():
+            if squares[from_sq] == elephant and squares[eye] == EMPTY:
+                return from_sq
+        horse = side | HORSE
+        for from_sq, leg in HORSE_ATTACKS[sq].items():
+            if squares[from_sq] == horse and squares[leg] == EMPTY:
+                return from_sq
+        
+        # The first piece on each ray may be a chariot, the piece behind it a cannon
+        chariot_sq = None
+        for delta in ORTHOGONAL_DELTAS:
+            from_sq = sq + delta
+            while squares[from_sq] == EMPTY:
+                from_sq += delta
+            if squares[from_sq] == OFFBOARD:
+                continue
+            if squares[from_sq] == side | CHARIOT and chariot_sq is None:
+                chariot_sq = from_sq
+            from_sq += delta
+            while squares[from_sq] == EMPTY:
+                from_sq += delta
+            if squares[from_sq] == side | CANNON:
+                return from_sq
+        if chariot_sq is not None:
+            return chariot_sq
+        
+        general = side | GENERAL
+        for from_sq in GENERAL_ATTACKS[side][sq]:
+            if squares[from_sq] == general:
+                return from_sq
+        return None
+
+    def see(self, sq, side, from_sq=None):
+        """
+        Static exchange evaluation of the piece on sq: the material side wins by
+        capturing there, both sides always recapturing with their least valuable
+        attacker and stopping once that would lose material.
+        With from_sq the first capture is made by that piece whatever it costs (to
+        score a capture move); without it side may decline, so the result is >= 0.
+        Every capture really vacates its square in the mailbox, so x-rays follow:
+        a chariot behind the capturer joins in, and cannons gain or lose screens.
+        """
+        squares = self.squares
+        target = squares[sq]
+        forced = from_sq is not None
+        if not forced:
+            from_sq = self.least_valuable_attacker(sq, side)
+        
+        gains = []  # Value taken by each capture in turn
+        vacated = []
+        captured = target
+        while from_sq is not None:
+            gains.append(SEE_VALUES[captured & PIECE_TYPE_MASK])
+            if captured & PIECE_TYPE_MASK == GENERAL:
+                break
+            captured = squares[from_sq]
+            vacated.append((from_sq, captured))
+            squares[from_sq] = EMPTY
+            squares[sq] = captured
+            side ^= SIDE_MASK
+            from_sq = self.least_valuable_attacker(sq, side)
+        for from_sq, piece in vacated:
+            squares[from_sq] = piece
+        squares[sq] = target
+        
+        if not gains:
+            return 0
+        # Back up the exchange: each recapture is only made if it pays
+        score = 0
+        for gain in reversed(gains[1:]):
+            score = max(0, gain - score)
+        score = gains[0] - score
+        return score if forced else max(0, score)
+
+    def is_generals_facing(self):
+        """Check if the two generals are facing each other directly"""
+        red_king_sq, black_king_sq = self.king_squares[RED], self.king_squares[BLACK]
+        
+        # If either king is missing, return False
+        if red_king_sq is None or black_king_sq is None:
+            return False
+            
+        # Flying general: the black general is the first piece on the red general's file ray
+        row, col = SQUARE_ROW[red_king_sq], SQUARE_COL[red_king_sq]
+        return bool(FILE_RAYS[row][self.file_occupancy[col]] << col & SQUARE_BITS[black_king_sq])
+
+    def is_in_check(self, side):
+        """Check if the king of the given side (RED or BLACK) is in check"""
+        red_king_sq, black_king_sq = self.king_squares[RED], self.king_squares[BLACK]
+        
+        if red_king_sq is None or black_king_sq is None:
+            return False
+        
+        # First check the special case of facing generals
+        if self.is_generals_facing():
+            return True  # Both kings are in check in this case
+        
+        # Then check the normal cases of being under attack
+        if side == RED:
+            return self.is_position_under_attack(red_king_sq, BLACK)
+        else:
+            return self.is_position_under_attack(black_king_sq, RED)
+
+
+class AttackMap:
+    """
+    Who attacks what in one position, built once per evaluated node and shared by
+    the evaluation terms. For each side and square: counts[side][sq] is the number
+    of that side's pieces attacking sq, least[side][sq] the square of the cheapest
+    of them (or None). A piece attacks every square it could capture on, so pieces
+    defending their own side are counted too; cannons attack only beyond a screen.
+    """
+
+    def __init__(self, board):
+        squares = board.squares
+        self.counts = {}
+        self.least = {}
+        for side in (RED, BLACK):
+            counts = [0] * 256
+            least = [None] * 256
+            # Cheapest pieces first, so the first attacker seen on a square is the least
+            # valuable; ties go by square so the map doesn't depend on set order
+            for key in sorted([ATTACKER_ORDER[squares[sq] & PIECE_TYPE_MASK] << 8 | sq
+                               for sq in board.piece_squares[side]]):
+                from_sq = key & 255
+                piece_type = squares[from_sq] & PIECE_TYPE_MASK
+                if piece_type == CHARIOT:
+                    targets = []
+                    for delta in ORTHOGONAL_DELTAS:
+                        to_sq = from_sq + delta
+                        while squares[to_sq] == EMPTY:
+                            targets.append(to_sq)
+                            to_sq += delta
+                        if squares[to_sq] != OFFBOARD:
+                            targets.append(to_sq)
+                elif piece_type == CANNON:
+                    targets = []
+                    for delta in ORTHOGONAL_DELTAS:
+                        to_sq = from_sq + delta
+                        while squares[to_sq] == EMPTY:
+                            to_sq += delta
+                        if squares[to_sq] == OFFBOARD:
+                            continue
+                        to_sq += delta
+                        while squares[to_sq] == EMPTY:
+                            to_sq += delta
+                        if squares[to_sq] != OFFBOARD:
+                            targets.append(to_sq)
+                elif piece_type == HORSE:
+                    targets = [to_sq for to_sq, leg in HORSE_MOVES[from_sq].items() if squares[leg] == EMPTY]
+                elif piece_type == ELEPHANT:
+                    targets = [to_sq for to_sq, eye in ELEPHANT_MOVES[side][from_sq].items()
+                               if squares[eye] == EMPTY]
+                else:
+                    targets = STEP_MOVES[piece_type][side][from_sq]
+                for to_sq in targets:
+                    if not counts[to_sq]:
+                        least[to_sq] = from_sq
+                    counts[to_sq] += 1
+            self.counts[side] = counts
+            self.least[side] = least
+
+
+def check_move_generator(positions=200, seed=None):
+    """
+    Compare Board.get_piece_moves with a full is_valid_move scan on random positions.
+    Returns the number of mismatching pieces (0 means both generators agree).
+    """
+    rng = random.Random(seed)
+    pieces = [side | piece_type for side in (RED, BLACK) for piece_type in range(1, 8)]
+    mismatches = 0
+    for _ in range(positions):
+        board = Board()
+        occupied = rng.sample(BOARD_SQUARES, rng.randint(2, 32))
+        for sq in occupied:
+            board.add_piece(sq, rng.choice(pieces))
+
+        for sq in occupied:
+            expected = {to_sq for to_sq in BOARD_SQUARES if board.is_valid_move(sq, to_sq)}
+            generated = board.get_piece_moves(sq)
+            if len(generated) != len(expected) or set(generated) != expected:
+                mismatches += 1
+                print(f"Mismatch for {PIECE_GLYPHS[board.squares[sq]]} at "
+                      f"{(SQUARE_ROW[sq], SQUARE_COL[sq])}: "
+                      f"generated {sorted(generated)}, expected {sorted(expected)}")
+    return mismatches
+
+
+def random_board(rng, max_pieces=30):
+    """A random position with one general per side inside its palace"""
+    pieces = [side | piece_type for side in (RED, BLACK) for piece_type in range(2, 8)]
+    board = Board()
+    board.add_piece(square(rng.randint(7, 9), rng.randint(3, 5)), RED | GENERAL)
+    board.add_piece(square(rng.randint(0, 2), rng.randint(3, 5)), BLACK | GENERAL)
+    empty = [sq for sq in BOARD_SQUARES if board.squares[sq] == EMPTY]
+    for sq in rng.sample(empty, rng.randint(0, max_pieces)):
+        board.add_piece(sq, rng.choice(pieces))
+    return board
+
+
+def check_attack_detection(positions=200, seed=None):
+    """
+    Compare Board.is_position_under_attack with scan_position_under_attack on every
+    square of random positions, and is_in_check with the scan-based rule.
+    Returns the number of disagreements (0 means both agree).
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(positions):
+        board = random_board(rng)
+
+        for side in (RED, BLACK):
+            for sq in BOARD_SQUARES:
+                if (board.is_position_under_attack(sq, side)
+                        != board.scan_position_under_attack(sq, side)):
+                    mismatches += 1
+                    print(f"Attack mismatch on {(SQUARE_ROW[sq], SQUARE_COL[sq])} by side {side}")
+
+            red_king_sq, black_king_sq = board.find_kings()
+            facing = (SQUARE_COL[red_king_sq] == SQUARE_COL[black_king_sq]
+                      and board._pieces_between(black_king_sq, red_king_sq) == 0)
+            king_sq = red_king_sq if side == RED else black_king_sq
+            expected = facing or board.scan_position_under_attack(king_sq, side ^ SIDE_MASK)
+            if board.is_in_check(side) != expected:
+                mismatches += 1
+                print(f"Check mismatch for side {side}")
+    return mismatches
+
+
+def check_legal_moves(positions=200, seed=None):
+    """
+    Compare Board.generate_legal_moves with playing every pseudo-legal move and
+    testing is_in_check, on random positions.
+    Returns the number of positions where they disagree (0 means they agree).
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(positions):
+        board = random_board(rng)
+        for side in (RED, BLACK):
+            expected = set()
+            for move in board.generate_moves(side):
+                board.make_move(move)
+                if not board.is_in_check(side):
+                    expected.add(move)
+                board.unmake_move()
+            legal = board.generate_legal_moves(side)
+            if len(legal) != len(expected) or set(legal) != expected:
+                mismatches += 1
+                print(f"Legal move mismatch for side {side}: "
+                      f"missing {sorted(expected - set(legal))}, extra {sorted(set(legal) - expected)}")
+    return mismatches
+
+
+TT_SIZE_MB = 16  # Default transposition table size
+TT_EXACT, TT_LOWER, TT_UPPER = 1, 2, 3  # Bound types; 0 marks an empty slot
+_TT_SCORE_OFFSET = 1 << 31
+
+# Search switches, read by ChineseChess on every search so they can be flipped for A/B games
+SEARCH_CONFIG = {
+    'quiescence_checks': False,  # Also search quiet checking moves on the first quiescence ply
+    'null_move': True,  # Null-move pruning in null-window nodes
+    'late_move_reductions': True,  # Search late quiet moves one ply shallower first
+}
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_MATERIAL = 900  # Horse/chariot/cannon material the side to move needs for a null move
+LMR_MIN_DEPTH = 3
+LMR_FULL_MOVES = 3  # Moves searched at full depth before reductions start
+MAX_SEARCH_PLY = 64  # Plies with killer move slots; also caps check extensions
+MATE_SCORE = 100000  # Being mated at ply p scores -(MATE_SCORE - p) for the mated side
+MATE_BOUND = MATE_SCORE - 1000  # Scores beyond this are mate scores
+HISTORY_LIMIT = 1 << 16  # History scores are halved once one passes this, staying below killer scores
+DELTA_MARGIN = 300  # Quiescence skips captures that can't reach alpha even with this much slack
+ASPIRATION_WINDOW = 50  # Root window half-width around the previous iteration's score
+
+
+class TranspositionTable:
+    """
+    Fixed-size table of search results keyed by Board.key.
+    Entries live in two preallocated arrays of 64-bit words (full key and packed
+    data), 16 bytes per entry, grouped in two-slot buckets: slot 0 keeps the
+    deepest result of the current search, slot 1 is always replaced.
+    Packed data: score + offset (32 bits) | move (16) | depth (8) | age (6) | bound (2)
+    """
+
+    def __init__(self, size_mb=TT_SIZE_MB):
+        buckets = 1
+        while buckets * 2 * 32 <= size_mb << 20:  # 32 bytes per two-slot bucket
+            buckets *= 2
+        self.bucket_mask = buckets - 1
+        self.age = 0
+        self.clear()
+
+    def clear(self):
+        """Empty every slot, e.g. at the start of a new game"""
+        entries = (self.bucket_mask + 1) * 2
+        self.keys = array('Q', bytes(8 * entries))
+        self.data = array('Q', bytes(8 * entries))
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        """Age the table so entries from earlier searches are replaced first, and reset the counters"""
+        self.age = (self.age + 1) & 63
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key, ply=0, count=True):
+        """
+        Return (depth, score, bound, move) stored for key, or None.
+        Mate scores are stored relative to the entry's node and returned relative to the root at ply.
+        Lookups made outside the search pass count=False so they stay out of hit_rate.
+        """
+        if count:
+            self.probes += 1
+        index = (key & self.bucket_mask) << 1
+        keys = self.keys
+        if keys[index] != key:
+            index += 1
+            if keys[index] != key:
+                return None
+        if count:
+            self.hits += 1
+        data = self.data[index]
+        score = (data >> 32) - _TT_SCORE_OFFSET
+        if score > MATE_BOUND:
+            score -= ply
+        elif score < -MATE_BOUND:
+            score += ply
+        return data >> 8 & 255, score, data & 3, data >> 16 & 0xFFFF
+
+    def store(self, key, depth, score, bound, move, ply=0):
+        if score > MATE_BOUND:
+            score += ply
+        elif score < -MATE_BOUND:
+            score -= ply
+        index = (key & self.bucket_mask) << 1
+        keys, data = self.keys, self.data
+        old = data[index]
+        # Replace the depth-preferred slot if it holds this position, an entry from
+        # an older search or a shallower one; otherwise use the always-replace slot
+        if keys[index] != key and (old >> 2 & 63) == self.age and (old >> 8 & 255) > depth:
+            index += 1
+        keys[index] = key
+        data[index] = ((score + _TT_SCORE_OFFSET) << 32 | move << 16
+                       | min(depth, 255) << 8 | self.age << 2 | bound)
+
+    def hit_rate(self):
+        """Fraction of probes since the last new_search that found an entry"""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def fill(self, sample=2000):
+        """
+        Rough fraction of slots written by the current search: only the first sample
+        slots are checked, so treat it as an estimate, not an exact count
+        """
+        data = self.data[:sample]
+        age = self.age
+        return sum(1 for word in data if word & 3 and (word >> 2 & 63) == age) / len(data)
+
+
+SEARCH_MAX_DEPTH = 5  # Iterative deepening cap when only time limits the search (node mode uses MAX_SEARCH_PLY)
+TIME_POLL_NODES = 256  # Nodes between time/node limit checks (a power of two)
+DEFAULT_MOVES_TO_GO = 30  # Moves assumed left when a clock has no moves-to-go
+SEARCH_POLL_MS = 50  # How often the Tk loop checks for a finished AI search
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time manager or the cancellation token stops it"""
+
+
+class TimeManager:
+    """
+    Limits for one search. Either a game clock (seconds left, increment per move
+    and optionally moves to go), a fixed time per move, a fixed depth or a fixed
+    node count. The fixed depth and node modes never look at the clock, so their
+    searches are reproducible.
+    The soft limit stops iterative deepening from starting another iteration;
+    the hard limit aborts the search in progress.
+    """
+
+    def __init__(self, move_time=5.0, clock=None, increment=0.0, moves_to_go=None,
+                 depth=None, nodes=None):
+        self.move_time = move_time
+        self.clock = clock
+        self.increment = increment
+        self.moves_to_go = moves_to_go
+        # A node budget alone deepens until it runs out, like the clock's hard limit
+        self.max_depth = depth or (MAX_SEARCH_PLY if nodes is not None else SEARCH_MAX_DEPTH)
+        self.node_limit = nodes
+        self.timed = depth is None and nodes is None
+        self.start_time = 0.0
+        self.soft_limit = self.hard_limit = float('inf')
+
+    def start(self):
+        """Start the clock for a new search and allocate its limits"""
+        self.start_time = time.time()
+        if not self.timed:
+            self.soft_limit = self.hard_limit = float('inf')
+        elif self.clock is not None:
+            target = self.clock / (self.moves_to_go or DEFAULT_MOVES_TO_GO) + self.increment
+            self.hard_limit = min(target * 3, self.clock * 0.8)
+            self.soft_limit = min(target, self.hard_limit)
+        else:
+            # Another iteration usually costs more than everything before it
+            self.hard_limit = self.move_time
+            self.soft_limit = self.move_time / 2
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def next_iteration(self, depth):
+        """True if iterative deepening should go on to search depth"""
+        return depth <= self.max_depth and self.elapsed() < self.soft_limit
+
+    def out_of_budget(self, nodes):
+        """Polled every TIME_POLL_NODES nodes: True once the hard limit or the node limit is hit"""
+        if self.node_limit is not None and nodes >= self.node_limit:
+            return True
+        return self.elapsed() > self.hard_limit
+
+
+class Searcher:
+    """
+    The AI: evaluation plus alpha-beta search with its transposition table,
+    killer/history tables and time manager. It only touches the Board passed to
+    search (the UI hands it a copy), so it can run in a worker thread.
+    """
+
+    def __init__(self, time_manager=None):
+        self.board = Board()
+        self.tt = TranspositionTable()  # Shared by every search, cleared per game
+        self.history = [0] * (24 << 8)  # Quiet cutoff history indexed piece << 8 | to_square
+        self.time_manager = time_manager or TimeManager()  # Time or depth/node limits per search
+        self.stop_event = threading.Event()  # Cancellation token of the running search
+        self.killers = [[0, 0] for _ in range(MAX_SEARCH_PLY)]
+        self.root_ply = 0
+        self.nodes = 0
+        self.principal_variations = {}  # Search depth -> PV line of that completed iteration
+
+    def clear(self):
+        """Forget everything learned in the previous game"""
+        self.tt.clear()
+        self.history = [0] * (24 << 8)
+
+    def evaluate_board(self):
+        
+        score = 0
+        squares = self.board.squares
+        for sq in BOARD_SQUARES:
+            piece = squares[sq]
+            if piece:
+                row = SQUARE_ROW[sq]
+                piece_type = piece & PIECE_TYPE_MASK
+                value = PIECE_VALUES[piece_type]
+                if piece & BLACK:  # Black pieces (AI)
+                    score += value
+                    # Bonus for advanced positions
+                    if piece_type == PAWN or piece_type == CANNON:
+                        score += (row * 10)  # Encourage forward movement
+                else:  # Red pieces (Human)
+                    score -= value
+                    if piece_type == PAWN or piece_type == CANNON:
+                        score -= ((9 - row) * 10)
+        
+        return score
+
+    def order_moves(self, moves, tt_move, ply):
+        """
+        Sort moves in place, best first: the TT move, captures by MVV-LVA, the two
+        killer moves of this ply, captures that lose material by SEE, then quiet
+        moves by history score
+        """
+        board = self.board
+        squares = board.squares
+        history = self.history
+        killer1, killer2 = self.killers[ply] if ply < MAX_SEARCH_PLY else (0, 0)
+        
+        def ordering_score(move):
+            if move == tt_move:
+                return 1 << 30
+            victim = squares[move & 255]
+            if victim:
+                # Captures that lose material by SEE go after the killers
+                attacker = squares[move >> 8]
+                if (PIECE_VALUES[victim & PIECE_TYPE_MASK] < PIECE_VALUES[attacker & PIECE_TYPE_MASK]
+                        and board.see(move & 255, attacker & SIDE_MASK, move >> 8) < 0):
+                    return (1 << 17) + mvv_lva(squares, move)
+                return (1 << 20) + mvv_lva(squares, move)
+            if move == killer1:
+                return 1 << 19
+            if move == killer2:
+                return 1 << 18
+            return history[squares[move >> 8] << 8 | move & 255]
+        
+        moves.sort(key=ordering_score, reverse=True)
+
+    def record_cutoff(self, move, depth, ply):
+        """Credit a quiet move that caused a beta cutoff in the killer and history tables"""
+        squares = self.board.squares
+        if squares[move & 255]:
+            return
+        if ply < MAX_SEARCH_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        index = squares[move >> 8] << 8 | move & 255
+        self.history[index] += depth * depth
+        if self.history[index] > HISTORY_LIMIT:
+            self.history = [value >> 1 for value in self.history]
+
+    def new_search(self):
+        """Reset per-search state: age the TT, decay the history table, clear killers"""
+        self.tt.new_search()
+        self.history = [value >> 1 for value in self.history]
+        self.killers = [[0, 0] for _ in range(MAX_SEARCH_PLY)]
+        self.root_ply = self.board.ply
+        self.nodes = 0
+
+    def evaluate_king_safety(self, side, attacks):
+        """Evaluate king safety and surrounding protection"""
+        king_sq = self.board.king_squares[side]
+        if king_sq is None:
+            return -9999
+        
+        squares = self.board.squares
+        safety = 0
+        
+        # Check protecting pieces (padding squares never match a side)
+        for delta in KING_ZONE_DELTAS:
+            if squares[king_sq + delta] & side:
+                safety += 30
+        
+        # Penalty for exposed king (an attacked general, or the generals facing)
+        if attacks.counts[side ^ SIDE_MASK][king_sq] or self.board.is_generals_facing():
+            safety -= 200
+        
+        return safety
+
+    def evaluate_position_simple(self):
+        board = self.board
+        
+        # Material and position bonuses are kept up to date by the board
+        score = (board.material[BLACK] + board.pst[BLACK]
+                 - board.material[RED] - board.pst[RED])
+        
+        # Calculate piece safety
+        attacks = AttackMap(board)  # Shared by the safety terms below
+        for sq in board.piece_squares[BLACK]:  # Black pieces (AI)
+            score += self.evaluate_piece_safety(sq, BLACK, attacks)
+        for sq in board.piece_squares[RED]:  # Red pieces (Human)
+            score -= self.evaluate_piece_safety(sq, RED, attacks)
+    
+        # King safety
+        king_safety = self.evaluate_king_safety(BLACK, attacks) - self.evaluate_king_safety(RED, attacks)
+        score += king_safety
+        
+        return score
+
+    def evaluate_piece_safety(self, sq, side, attacks):
+        """
+        Evaluate how safe a piece is in its current position: half of what the
+        opponent wins by exchanging on its square (the owner may still move it away)
+        """
+        enemy = side ^ SIDE_MASK
+        if not attacks.counts[enemy][sq]:
+            return 0
+        # The exchange starts with the attack map's least valuable attacker
+        return -(max(0, self.board.see(sq, enemy, attacks.least[enemy][sq])) // 2)
+
+    def count_node(self):
+        """Count a search node and abort the search when it is cancelled or out of time"""
+        self.nodes += 1
+        if not self.nodes & (TIME_POLL_NODES - 1) and (
+                self.stop_event.is_set() or self.time_manager.out_of_budget(self.nodes)):
+            raise SearchAborted
+
+    def minimax(self, depth, alpha, beta, maximizing_player, allow_null=True):
+        """Minimax algorithm with alpha-beta pruning and simplified evaluation"""
+        self.count_node()
+        board = self.board
+        side = BLACK if maximizing_player else RED
+        ply = board.ply - self.root_ply
+        
+        # A repeated position scores as a draw. Tested before the TT, whose
+        # scores don't depend on the path that led here.
+        if board.is_repetition():
+            return 0
+        
+        # Check extension: a side in check gets one more ply to find its way out
+        in_check = board.is_in_check(side)
+        if in_check and ply < MAX_SEARCH_PLY:
+            depth += 1
+        if depth <= 0:
+            return self.quiescence(alpha, beta, maximizing_player)
+        
+        key = board.key
+        
+        # Transposition table: reuse a deep enough result, else try its best move first
+        tt_move = 0
+        entry = self.tt.probe(key, ply)
+        if entry:
+            tt_depth, tt_score, tt_bound, tt_move = entry
+            if tt_depth >= depth:
+                if tt_bound == TT_EXACT:
+                    return tt_score
+                if tt_bound == TT_LOWER:
+                    alpha = max(alpha, tt_score)
+                else:
+                    beta = min(beta, tt_score)
+                if beta <= alpha:
+                    return tt_score
+        window_alpha, window_beta = alpha, beta
+        
+        null_move = SEARCH_CONFIG['null_move'] and allow_null and depth > NULL_MOVE_REDUCTION
+        reduce = SEARCH_CONFIG['late_move_reductions'] and depth >= LMR_MIN_DEPTH and not in_check
+        
+        # Null-move pruning: if passing still fails high for the side to move, so
+        # will its real moves. Only in null-window nodes, never in check or with too
+        # little material to rule out zugzwang.
+        if (null_move and not in_check and beta - alpha == 1
+                and self._null_move_material(side) >= NULL_MOVE_MIN_MATERIAL):
+            board.make_null_move()
+            if maximizing_player:
+                eval = self.minimax(depth - 1 - NULL_MOVE_REDUCTION, beta - 1, beta, False, False)
+            else:
+                eval = self.minimax(depth - 1 - NULL_MOVE_REDUCTION, alpha, alpha + 1, True, False)
+            board.unmake_null_move()
+            # Fail hard: a mate found after passing proves nothing about real moves
+            if maximizing_player and eval >= beta:
+                return beta
+            if not maximizing_player and eval <= alpha:
+                return alpha
+        
+        moves = board.generate_legal_moves(side)
+        if not moves:
+            # No legal move loses in xiangqi, whether in check or not; sooner is worse
+            return self.mated_score(maximizing_player)
+        self.order_moves(moves, tt_move, ply)
+        
+        squares = board.squares
+        best_move = 0
+        if maximizing_player:
+            best_eval = float('-inf')
+            
+            for index, move in enumerate(moves):
+                quiet = not squares[move & 255]
+                # Make move
+                board.make_move(move)
+                
+                # PVS: the first move gets the full window, the rest a null window
+                # around alpha, re-searched only if they turn out better. Late quiet
+                # non-checking moves are tried one ply shallower first.
+                if best_move:
+                    if reduce and quiet and index >= LMR_FULL_MOVES and not board.is_in_check(RED):
+                        eval = self.minimax(depth - 2, alpha, alpha + 1, False)
+                    else:
+                        eval = alpha + 1
+                    if eval > alpha:
+                        eval = self.minimax(depth - 1, alpha, alpha + 1, False)
+                    if alpha < eval < beta:
+                        eval = self.minimax(depth - 1, alpha, beta, False)
+                else:
+                    eval = self.minimax(depth - 1, alpha, beta, False)
+                if eval > best_eval:
+                    best_eval = eval
+                    best_move = move
+                alpha = max(alpha, eval)
+                
+                # Restore position
+                board.unmake_move()
+                
+                if beta <= alpha:
+                    self.record_cutoff(move, depth, ply)
+                    break
+        else:
+            best_eval = float('inf')
+            
+            for index, move in enumerate(moves):
+                quiet = not squares[move & 255]
+                board.make_move(move)
+                
+                if best_move:
+                    if reduce and quiet and index >= LMR_FULL_MOVES and not board.is_in_check(BLACK):
+                        eval = self.minimax(depth - 2, beta - 1, beta, True)
+                    else:
+                        eval = beta - 1
+                    if eval < beta:
+                        eval = self.minimax(depth - 1, beta - 1, beta, True)
+                    if alpha < eval < beta:
+                        eval = self.minimax(depth - 1, alpha, beta, True)
+                else:
+                    eval = self.minimax(depth - 1, alpha, beta, True)
+                if eval < best_eval:
+                    best_eval = eval
+                    best_move = move
+                beta = min(beta, eval)
+                
+                # Restore position
+                board.unmake_move()
+                
+                if beta <= alpha:
+                    self.record_cutoff(move, depth, ply)
+                    break
+        
+        # Bound type relative to the window this node actually searched
+        if best_eval <= window_alpha:
+            bound = TT_UPPER
+        elif best_eval >= window_beta:
+            bound = TT_LOWER
+        else:
+            bound = TT_EXACT
+        self.tt.store(key, depth, best_eval, bound, best_move, ply)
+        return best_eval
+
+    def mated_score(self, maximizing_player):
+        """Score of the side to move having no legal move, at the current distance from the root"""
+        score = MATE_SCORE - (self.board.ply - self.root_ply)
+        return -score if maximizing_player else score
+
+    def _null_move_material(self, side):
+        """Horse, chariot and cannon material of one side (what null-move pruning needs)"""
+        squares = self.board.squares
+        material = 0
+        for sq in self.board.piece_squares[side]:
+            piece_type = squares[sq] & PIECE_TYPE_MASK
+            if piece_type == HORSE or piece_type == CHARIOT or piece_type == CANNON:
+                material += PIECE_VALUES[piece_type]
+        return material
+
+    def quiescence(self, alpha, beta, maximizing_player, qply=0):
+        """
+        Search captures (and checks on the first ply if enabled) until the position is
+        quiet, so the search never stops in the middle of an exchange
+        """
+        self.count_node()
+        board = self.board
+        squares = board.squares
+        side = BLACK if maximizing_player else RED
+        
+        if board.is_in_check(side):
+            # No standing pat while in check: search every evasion
+            moves = board.generate_legal_moves(side)
+            if not moves:
+                return self.mated_score(maximizing_player)
+            best_eval = float('-inf') if maximizing_player else float('inf')
+        else:
+            # Stand pat: the side to move can decline every capture
+            best_eval = self.evaluate_position_simple()
+            if maximizing_player:
+                if best_eval >= beta:
+                    return best_eval
+                alpha = max(alpha, best_eval)
+            else:
+                if best_eval <= alpha:
+                    return best_eval
+                beta = min(beta, best_eval)
+            
+            moves = []
+            checks = []
+            search_checks = qply == 0 and SEARCH_CONFIG['quiescence_checks']
+            for move in board.generate_legal_moves(side):
+                victim = squares[move & 255]
+                if victim:
+                    # Delta pruning: skip captures that can't reach the window
+                    gain = PIECE_VALUES[victim & PIECE_TYPE_MASK] + DELTA_MARGIN
+                    if maximizing_player and best_eval + gain <= alpha:
+                        continue
+                    if not maximizing_player and best_eval - gain >= beta:
+                        continue
+                    # Captures that lose material by SEE can't improve on standing pat
+                    if (PIECE_VALUES[victim & PIECE_TYPE_MASK] < PIECE_VALUES[squares[move >> 8] & PIECE_TYPE_MASK]
+                            and board.see(move & 255, side, move >> 8) < 0):
+                        continue
+                    moves.append(move)
+                elif search_checks:
+                    board.make_move(move)
+                    if board.is_in_check(side ^ SIDE_MASK):
+                        checks.append(move)
+                    board.unmake_move()
+            moves.sort(key=lambda move: mvv_lva(squares, move), reverse=True)
+            moves += checks
+        
+        for move in moves:
+            board.make_move(move)
+            eval = self.quiescence(alpha, beta, not maximizing_player, qply + 1)
+            board.unmake_move()
+            
+            if maximizing_player:
+                best_eval = max(best_eval, eval)
+                alpha = max(alpha, eval)
+            else:
+                best_eval = min(best_eval, eval)
+                beta = min(beta, eval)
+            if beta <= alpha:
+                break
+        return best_eval
+
+    def search(self, board, stop_event=None):
+        """
+        Pick a move for black on board, which is searched in place and restored.
+        Returns the best move of the last completed iteration, or None if black has
+        no legal move. Setting stop_event ends the search early, like the hard time limit.
+        """
+        self.board = board
+        self.stop_event = stop_event or threading.Event()
+        best_move = None
+        time_manager = self.time_manager
+        time_manager.start()
+        self.new_search()
+        self.principal_variations = {}
+        
+        # Get all legal moves
+        moves = board.generate_legal_moves(BLACK)
+        if not moves:
+            return None
+            
+        # Order root moves by the static score of the position each one leads to,
+        # all scored in one batch; captures and history break ties
+        self.order_moves(moves, 0, 0)
+        scores = evaluate_batch(board.encode_moves(moves))
+        order = sorted(range(len(moves)), key=lambda index: -scores[index])
+        moves = [moves[index] for index in order]
+        
+        # Iterative deepening: each iteration starts from the previous best move, and
+        # only fully searched iterations count. If even the first one is aborted the
+        # best-ordered move is played.
+        iteration_score = None
+        search_depth = 1  # From depth 1, so a fixed-depth limit always runs its iterations
+        while time_manager.next_iteration(search_depth):
+            # Aspiration window around the previous score; a side that fails is
+            # opened up and the iteration searched again
+            if iteration_score is None:
+                alpha, beta = float('-inf'), float('inf')
+            else:
+                alpha, beta = iteration_score - ASPIRATION_WINDOW, iteration_score + ASPIRATION_WINDOW
+            try:
+                while True:
+                    iteration_score, iteration_move = self.search_root(moves, search_depth, alpha, beta)
+                    if iteration_score <= alpha:
+                        alpha = float('-inf')
+                    elif iteration_score >= beta:
+                        beta = float('inf')
+                    else:
+                        break
+            except SearchAborted:
+                board.unwind(self.root_ply)
+                break
+            
+            best_move = iteration_move
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+            self.tt.store(board.key, search_depth, iteration_score, TT_EXACT, best_move)
+            pv = self.principal_variation(best_move, search_depth)
+            self.principal_variations[search_depth] = pv
+            print(f"Depth {search_depth}: score {iteration_score}, nodes {self.nodes}, "
+                  f"time {time_manager.elapsed():.2f}s, pv {' '.join(move_notation(move) for move in pv)}")
+            
+            # A forced mate either way won't change with more depth
+            if abs(iteration_score) > MATE_BOUND:
+                break
+            search_depth += 1
+
+        if best_move is None:
+            best_move = moves[0]
+        print(f"Transposition table: {self.tt.hit_rate():.1%} hit rate, {self.tt.fill():.1%} full")
+        return best_move
+
+    def search_root(self, moves, depth, alpha, beta):
+        """
+        Search the root moves for black with PVS inside (alpha, beta).
+        Returns (score, move); raises SearchAborted if the search is stopped.
+        """
+        board = self.board
+        best_score = float('-inf')
+        best_move = None
+        for move in moves:
+            # Make temporary move
+            board.make_move(move)
+            
+            if best_move:
+                score = self.minimax(depth - 1, alpha, alpha + 1, False)
+                if alpha < score < beta:
+                    score = self.minimax(depth - 1, alpha, beta, False)
+            else:
+                score = self.minimax(depth - 1, alpha, beta, False)
+            
+            # Restore position
+            board.unmake_move()
+            
+            if score > best_score:
+                best_score = score
+                best_move = move
+                alpha = max(alpha, score)
+                if alpha >= beta:
+                    break
+        return best_score, best_move
+
+    def principal_variation(self, move, depth):
+        """Follow best moves in the transposition table from a root move, up to depth plies"""
+        board = self.board
+        line = [move]
+        board.make_move(move)
+        while len(line) < depth:
+            entry = self.tt.probe(board.key, count=False)
+            if not entry or entry[3] not in board.generate_legal_moves(board.side):
+                break
+            line.append(entry[3])
+            board.make_move(entry[3])
+        for _ in line:
+            board.unmake_move()
+        return line
+
 
 class ChineseChess:
 
@@ -41,6 +1894,14 @@ class ChineseChess:
         
         self.game_history = []  # List to store all games
         
+        # The AI searches in a worker thread and hands its move back through a queue
+        self.searcher = Searcher()
+        self.search_results = queue.Queue()  # (search id, move, error) from finished searches; error is None on success
+        self.search_id = 0  # Id of the latest search; older results are stale
+        self.search_thread = None
+        self.stop_event = None  # Cancellation token of the running search
+        self.ai_thinking = False
+        
         # Board dimensions and styling
         self.board_size = 9  # 9x10 board
         self.cell_size = 54
@@ -118,6 +1979,18 @@ class ChineseChess:
         )
         self.next_move_button.pack(pady=5)
 
+        # Create move now button (enabled while the AI is thinking)
+        self.move_now_button = tk.Button(
+            self.button_frame,
+            text="立即走棋",
+            command=self.move_now,
+            font=('SimSun', 12),
+            width=8,
+            height=1,
+            state=tk.DISABLED
+        )
+        self.move_now_button.pack(pady=5)
+
         self.set_button_states_for_gameplay()
 
         # Initialize game state
@@ -212,7 +2085,7 @@ class ChineseChess:
             'from_pos': from_pos,
             'to_pos': to_pos,
             'piece': piece,
-            'board_state': [row[:] for row in self.board]  # Deep copy of board
+            'board_state': self.board.to_grid()  # Snapshot of board
         }
         self.move_history.append(move)
 
@@ -245,8 +2118,7 @@ class ChineseChess:
             
         move = self.move_history[self.current_replay_index]
         # Restore board state
-        for i in range(len(self.board)):
-            self.board[i] = move['board_state'][i][:]
+        self.board = Board.from_grid(move['board_state'])
         
         # Highlight the move
         self.highlighted_positions = [move['from_pos'], move['to_pos']]
@@ -279,8 +2151,7 @@ class ChineseChess:
         if self.current_replay_index > 0:
             move = self.move_history[self.current_replay_index - 1]
             # Restore board state
-            for i in range(len(self.board)):
-                self.board[i] = move['board_state'][i][:]
+            self.board = Board.from_grid(move['board_state'])
         else:
             # If we're at the beginning, show initial board
             self.initialize_board()
@@ -307,8 +2178,8 @@ class ChineseChess:
             
     def on_click(self, event):
 
-        if self.replay_mode or self.game_over:  # Add game_over check
-            return  # Ignore clicks when game is over or in replay mode
+        if self.replay_mode or self.game_over or self.ai_thinking:  # Add game_over check
+            return  # Ignore clicks when game is over, in replay mode or while the AI thinks
 
         # Convert click coordinates to board position (remove the center_offset from here)
         col = round((event.x - self.board_margin) / self.cell_size)
@@ -316,7 +2187,7 @@ class ChineseChess:
         
         # Ensure click is within board bounds
         if 0 <= row < 10 and 0 <= col < 9:
-            clicked_piece = self.board[row][col]
+            clicked_piece = self.board.piece_at(row, col)
             
             # If a piece is already selected
             if self.selected_piece:
@@ -324,24 +2195,20 @@ class ChineseChess:
                 
                 # If clicking on another piece of the same color, select that piece instead
                 if (clicked_piece and 
-                    clicked_piece[0] == self.current_player[0].upper()):
+                    clicked_piece & SIDE_FLAGS[self.current_player]):
                     self.selected_piece = (row, col)
                     self.highlighted_positions = [(row, col)]  # Reset highlights for new selection
                     self.draw_board()
                 # If clicking on a valid move position
-                elif self.is_valid_move(self.selected_piece, (row, col)):
-                    # Store the current state to check for check
-                    original_piece = self.board[row][col]
-                    
+                elif self.board.is_valid_move(square(start_row, start_col), square(row, col)):
                     # Make the move temporarily
-                    self.board[row][col] = self.board[start_row][start_col]
-                    self.board[start_row][start_col] = None
+                    move = square(start_row, start_col) << 8 | square(row, col)
+                    self.board.make_move(move)
                     
                     # Check if the move puts own king in check
-                    if self.is_in_check(self.current_player):
+                    if self.board.is_in_check(SIDE_FLAGS[self.current_player]):
                         # Undo the move if it puts own king in check
-                        self.board[start_row][start_col] = self.board[row][col]
-                        self.board[row][col] = original_piece
+                        self.board.unmake_move()
 
 
                         if self.current_player == 'red':
@@ -367,7 +2234,7 @@ class ChineseChess:
                         self.add_move_to_history(
                             (start_row, start_col),
                             (row, col),
-                            self.board[row][col]
+                            self.board.piece_at(row, col)
                         )
 
                         # Add this code:
@@ -383,325 +2250,77 @@ class ChineseChess:
                     self.draw_board()
             
             # If no piece is selected and clicked on own piece, select it
-            elif clicked_piece and clicked_piece[0] == self.current_player[0].upper():
+            elif clicked_piece and clicked_piece & SIDE_FLAGS[self.current_player]:
                 self.selected_piece = (row, col)
                 self.highlighted_positions = [(row, col)]  # Initialize highlights with selected piece
                 self.draw_board()        
 
-    def evaluate_board(self):
-                
-        piece_values = {
-            '將': 0, '帥': 0,      # Kings - valued at 0 since they can't be captured
-            '車': 900,            # Chariot - most valuable piece
-            '馬': 450,            # Horse
-            '炮': 450,            # Cannon
-            '象': 200, '相': 200,  # Elephants
-            '士': 200, '仕': 200,  # Advisors
-            '卒': 100, '兵': 100   # Pawns - base value, will get bonus when advanced
-        }
-        
-        score = 0
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece:
-                    value = piece_values[piece[1]]
-                    if piece[0] == 'B':  # Black pieces (AI)
-                        score += value
-                        # Bonus for advanced positions
-                        if piece[1] in ['卒', '炮']:
-                            score += (row * 10)  # Encourage forward movement
-                    else:  # Red pieces (Human)
-                        score -= value
-                        if piece[1] in ['兵', '炮']:
-                            score -= ((9 - row) * 10)
-        
-        return score
-
-    def get_all_valid_moves(self, color):
-        """Get all valid moves for a given color"""
-        moves = []
-        for from_row in range(10):
-            for from_col in range(9):
-                piece = self.board[from_row][from_col]
-                if piece and piece[0] == color[0].upper():
-                    for to_row in range(10):
-                        for to_col in range(9):
-                            if self.is_valid_move((from_row, from_col), (to_row, to_col)):
-                                moves.append(((from_row, from_col), (to_row, to_col)))
-        return moves
-
-    def _move_sorting_score(self, move):
-        from_pos, to_pos = move
-        from_piece = self.board[from_pos[0]][from_pos[1]]
-        to_piece = self.board[to_pos[0]][to_pos[1]]
-        
-        score = 0
-        piece_values = {
-            '將': 0, '帥': 0,
-            '車': 900,
-            '馬': 450,
-            '炮': 450,
-            '象': 200, '相': 200,
-            '士': 200, '仕': 200,
-            '卒': 100, '兵': 100
-        }
-        
-        # Basic move scoring
-        if to_piece:  # Capture move
-            # MVV-LVA (Most Valuable Victim - Least Valuable Aggressor)
-            score = piece_values[to_piece[1]] * 10 - piece_values[from_piece[1]]
-        
-        # Try the move
-        original_piece = self.board[to_pos[0]][to_pos[1]]
-        self.board[to_pos[0]][to_pos[1]] = from_piece
-        self.board[from_pos[0]][from_pos[1]] = None
-        
-        # Check if this move puts our pieces in danger
-        current_safety = self.evaluate_piece_safety(to_pos[0], to_pos[1], from_piece, 'black')
-        score += current_safety
-        
-        # Extra points for checking the opponent
-        if self.is_in_check('red'):
-            score += 1000
-        
-        # Restore position
-        self.board[from_pos[0]][from_pos[1]] = from_piece
-        self.board[to_pos[0]][to_pos[1]] = original_piece
-        
-        return score
-
-    def evaluate_king_safety(self, color):
-        """Evaluate king safety and surrounding protection"""
-        kings = self.find_kings()
-        king_pos = kings[1] if color == 'black' else kings[0]
-        if not king_pos:
-            return -9999
-        
-        king_row, king_col = king_pos
-        safety = 0
-        
-        # Check protecting pieces
-        for dr in [-1, 0, 1]:
-            for dc in [-1, 0, 1]:
-                r, c = king_row + dr, king_col + dc
-                if 0 <= r < 10 and 0 <= c < 9:
-                    piece = self.board[r][c]
-                    if piece and piece[0] == color[0].upper():
-                        safety += 30
-        
-        # Penalty for exposed king
-        if self.is_in_check(color):
-            safety -= 200
-        
-        return safety
-
-    def evaluate_position_simple(self):
-        piece_values = {
-            '將': 0, '帥': 0,
-            '車': 900,
-            '馬': 450,
-            '炮': 450,
-            '象': 200, '相': 200,
-            '士': 200, '仕': 200,
-            '卒': 100, '兵': 100
-        }
-        
-        score = 0
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece:
-                    value = piece_values[piece[1]]
-                    position_bonus = 0
-                    
-                    # Position bonuses
-                    if piece[1] in ['車', '馬', '炮']:
-                        # Bonus for controlling center files
-                        if 2 <= col <= 6:
-                            position_bonus += 20
-                        # Bonus for penetration
-                        if piece[0] == 'B' and row > 4:
-                            position_bonus += 50
-                        elif piece[0] == 'R' and row < 5:
-                            position_bonus += 50
-                    
-                    # Calculate piece safety
-                    safety_score = self.evaluate_piece_safety(row, col, piece, 'black' if piece[0] == 'B' else 'red')
-                    
-                    if piece[0] == 'B':  # Black pieces (AI)
-                        score += value + position_bonus + safety_score
-                        if piece[1] == '卒':
-                            if row > 4:  # Crossed river
-                                score += 50 + (row - 4) * 20
-                            else:
-                                score += row * 10
-                    else:  # Red pieces (Human)
-                        score -= value + position_bonus + safety_score
-                        if piece[1] == '兵':
-                            if row < 5:
-                                score -= 50 + (4 - row) * 20
-                            else:
-                                score -= (9 - row) * 10
-        
-        # King safety
-        king_safety = self.evaluate_king_safety('black') - self.evaluate_king_safety('red')
-        score += king_safety
-        
-        return score
-
-    def minimax(self, depth, alpha, beta, maximizing_player):
-        """Minimax algorithm with alpha-beta pruning and simplified evaluation"""
-        if depth == 0:
-            return self.evaluate_position_simple()
-        
-        if maximizing_player:
-            max_eval = float('-inf')
-            moves = self.get_all_valid_moves('black')
-            
-            for from_pos, to_pos in moves:
-                # Store and make move
-                moving_piece = self.board[from_pos[0]][from_pos[1]]
-                captured_piece = self.board[to_pos[0]][to_pos[1]]
-                self.board[to_pos[0]][to_pos[1]] = moving_piece
-                self.board[from_pos[0]][from_pos[1]] = None
-                
-                if not self.is_in_check('black'):
-                    eval = self.minimax(depth - 1, alpha, beta, False)
-                    max_eval = max(max_eval, eval)
-                    alpha = max(alpha, eval)
-                
-                # Restore position
-                self.board[from_pos[0]][from_pos[1]] = moving_piece
-                self.board[to_pos[0]][to_pos[1]] = captured_piece
-                
-                if beta <= alpha:
-                    break
-            return max_eval if max_eval != float('-inf') else self.evaluate_position_simple()
-        else:
-            min_eval = float('inf')
-            moves = self.get_all_valid_moves('red')
-            
-            for from_pos, to_pos in moves:
-                moving_piece = self.board[from_pos[0]][from_pos[1]]
-                captured_piece = self.board[to_pos[0]][to_pos[1]]
-                self.board[to_pos[0]][to_pos[1]] = moving_piece
-                self.board[from_pos[0]][from_pos[1]] = None
-                
-                if not self.is_in_check('red'):
-                    eval = self.minimax(depth - 1, alpha, beta, True)
-                    min_eval = min(min_eval, eval)
-                    beta = min(beta, eval)
-                
-                # Restore position
-                self.board[from_pos[0]][from_pos[1]] = moving_piece
-                self.board[to_pos[0]][to_pos[1]] = captured_piece
-                
-                if beta <= alpha:
-                    break
-            return min_eval if min_eval != float('inf') else self.evaluate_position_simple()
-
-    def evaluate_piece_safety(self, row, col, piece, color):
-        """Evaluate how safe a piece is in its current position"""
-        safety_score = 0
-        piece_values = {
-            '將': 0, '帥': 0,
-            '車': 900,
-            '馬': 450,
-            '炮': 450,
-            '象': 200, '相': 200,
-            '士': 200, '仕': 200,
-            '卒': 100, '兵': 100
-        }
-        
-        # Check if the piece is under attack
-        is_attacked = False
-        defenders = 0
-        attackers = 0
-        
-        # Count attackers and defenders
-        for r in range(10):
-            for c in range(9):
-                checking_piece = self.board[r][c]
-                if checking_piece:
-                    if checking_piece[0] != color[0].upper():  # Enemy piece
-                        # If enemy can capture this piece
-                        if self.is_valid_move((r, c), (row, col)):
-                            attackers += 1
-                            is_attacked = True
-                            # Penalty based on value difference
-                            if piece_values[checking_piece[1]] < piece_values[piece[1]]:
-                                safety_score -= 50  # Extra penalty if threatened by lesser piece
-                    else:  # Friendly piece
-                        if self.is_valid_move((r, c), (row, col)):
-                            defenders += 1
-                            safety_score += 20  # Bonus for each defender
-        
-        # Heavy penalty if attacked and not defended
-        if is_attacked and defenders == 0:
-            safety_score -= 200
-        
-        # Bonus for defended pieces
-        if defenders > attackers:
-            safety_score += 100
-            
-        return safety_score
-
     def make_ai_move(self):
-        import time
-        
-        start_time = time.time()
-        max_time = 5.0  # Reduced from 10.0 to make moves faster
-        
-        best_score = float('-inf')
-        best_move = None
-        best_moving_piece = None
-        
-        # Get all valid moves and sort them by preliminary evaluation
-        moves = self.get_all_valid_moves('black')
-        if not moves:
+        """
+        Start the AI search on a copy of the board in a worker thread. The UI stays
+        live meanwhile; poll_ai_move picks up the result from the queue.
+        """
+        if self.ai_thinking or self.game_over or self.replay_mode or self.current_player != 'black':
             return
-            
-        # Sort moves by preliminary evaluation
-        moves.sort(key=self._move_sorting_score, reverse=True)
+        self.ai_thinking = True
+        self.search_id += 1
+        self.stop_event = threading.Event()
+        search_id, board, stop_event = self.search_id, self.board.copy(), self.stop_event
+        
+        def run_search():
+            # A failed search still posts a result, or the UI would wait for it forever
+            try:
+                self.search_results.put((search_id, self.searcher.search(board, stop_event), None))
+            except Exception as e:
+                traceback.print_exc()
+                self.search_results.put((search_id, None, e))
+        
+        self.search_thread = threading.Thread(target=run_search, daemon=True)
+        self.search_thread.start()
+        self.move_now_button.config(state=tk.NORMAL)
+        self.window.after(SEARCH_POLL_MS, self.poll_ai_move)
+
+    def poll_ai_move(self):
+        """Play the AI move once its search has finished; results of cancelled searches are dropped"""
+        while not self.search_results.empty():
+            search_id, best_move, error = self.search_results.get()
+            if self.ai_thinking and search_id == self.search_id:
+                self.ai_thinking = False
+                self.move_now_button.config(state=tk.DISABLED)
+                if error is not None:
+                    # Not a game result: black stays to move and can be played by hand
+                    self.show_centered_warning("AI Error", f"电脑搜索出错: {error}")
+                else:
+                    self.play_ai_move(best_move)
+                return
+        if self.ai_thinking:
+            self.window.after(SEARCH_POLL_MS, self.poll_ai_move)
+
+    def move_now(self):
+        """Stop the AI search and play the best move found so far"""
+        if self.ai_thinking:
+            self.stop_event.set()
+
+    def cancel_ai_move(self):
+        """Stop the AI search, wait for its thread and discard its move"""
+        if self.ai_thinking:
+            self.ai_thinking = False
+            self.stop_event.set()
+            self.search_thread.join()
+            self.move_now_button.config(state=tk.DISABLED)
+
+    def play_ai_move(self, best_move):
+        """Play the move picked by the AI search on the game board"""
+        board = self.board
         
-        # Iterative deepening
-        for search_depth in range(2, 6):  # Increased max depth to 6
-            if time.time() - start_time > max_time:
-                break
-                
-            alpha = float('-inf')
-            beta = float('inf')
-            
-            for from_pos, to_pos in moves:
-                if time.time() - start_time > max_time:
-                    break
-                    
-                moving_piece = self.board[from_pos[0]][from_pos[1]]
-                captured_piece = self.board[to_pos[0]][to_pos[1]]
-                
-                # Make temporary move
-                self.board[to_pos[0]][to_pos[1]] = moving_piece
-                self.board[from_pos[0]][from_pos[1]] = None
-                
-                if not self.is_in_check('black'):
-                    score = self.minimax(search_depth - 1, alpha, beta, False)
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_move = (from_pos, to_pos)
-                        best_moving_piece = moving_piece
-                
-                # Restore position
-                self.board[from_pos[0]][from_pos[1]] = moving_piece
-                self.board[to_pos[0]][to_pos[1]] = captured_piece
-
         # Make the best move found
         if best_move:
-            from_pos, to_pos = best_move
+            best_moving_piece = board.squares[best_move >> 8]
+            from_sq, to_sq = best_move >> 8, best_move & 255
+            from_pos = (SQUARE_ROW[from_sq], SQUARE_COL[from_sq])
+            to_pos = (SQUARE_ROW[to_sq], SQUARE_COL[to_sq])
             # Make the actual move
-            self.board[to_pos[0]][to_pos[1]] = best_moving_piece
-            self.board[from_pos[0]][from_pos[1]] = None
+            board.make_move(best_move)
             
             # Play sound if available
             if hasattr(self, 'move_sound') and self.move_sound:
@@ -723,39 +2342,17 @@ class ChineseChess:
 
     def is_checkmate(self, color):
         """
-        Check if the given color is in checkmate.
-        Returns True if the player has no legal moves to escape check.
+        Check if the given color has lost: in xiangqi a player with no legal moves
+        loses, whether checkmated or stalemated.
         """
-        # If not in check, can't be checkmate
-        if not self.is_in_check(color):
+        side = SIDE_FLAGS[color]
+        board = self.board
+
+        # Any legal move (including one out of check) keeps the game going
+        if board.generate_legal_moves(side):
             return False
-            
-        # Try every possible move for every piece of the current player
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece[0] == color[0].upper():  # If it's current player's piece
-                    # Try all possible destinations
-                    for to_row in range(10):
-                        for to_col in range(9):
-                            if self.is_valid_move((row, col), (to_row, to_col)):
-                                # Try the move
-                                original_piece = self.board[to_row][to_col]
-                                self.board[to_row][to_col] = piece
-                                self.board[row][col] = None
-                                
-                                # Check if still in check
-                                still_in_check = self.is_in_check(color)
-                                
-                                # Undo the move
-                                self.board[row][col] = piece
-                                self.board[to_row][to_col] = original_piece
-                                
-                                # If any move gets out of check, not checkmate
-                                if not still_in_check:
-                                    return False
         
-        # If no legal moves found, it's checkmate
+        # If no legal moves found, it's a loss
             
         self.game_over = True  # Add this line
 
@@ -782,7 +2379,7 @@ class ChineseChess:
 
     def initialize_board(self):
         # Initialize empty board
-        self.board = [[None for _ in range(9)] for _ in range(10)]
+        self.board = Board()
         
         # Set up initial piece positions
         self.setup_pieces()
@@ -790,32 +2387,32 @@ class ChineseChess:
     def setup_pieces(self):
         # Red pieces (bottom)
         red_pieces = {
-            (9, 0): 'R車', (9, 1): 'R馬', (9, 2): 'R相',
-            (9, 3): 'R仕', (9, 4): 'R帥', (9, 5): 'R仕',
-            (9, 6): 'R相', (9, 7): 'R馬', (9, 8): 'R車',
-            (7, 1): 'R炮', (7, 7): 'R炮',
-            (6, 0): 'R兵', (6, 2): 'R兵', (6, 4): 'R兵',
-            (6, 6): 'R兵', (6, 8): 'R兵'
+            (9, 0): RED | CHARIOT, (9, 1): RED | HORSE, (9, 2): RED | ELEPHANT,
+            (9, 3): RED | ADVISOR, (9, 4): RED | GENERAL, (9, 5): RED | ADVISOR,
+            (9, 6): RED | ELEPHANT, (9, 7): RED | HORSE, (9, 8): RED | CHARIOT,
+            (7, 1): RED | CANNON, (7, 7): RED | CANNON,
+            (6, 0): RED | PAWN, (6, 2): RED | PAWN, (6, 4): RED | PAWN,
+            (6, 6): RED | PAWN, (6, 8): RED | PAWN
         }
         
         # Black pieces (top)
         black_pieces = {
-            (0, 0): 'B車', (0, 1): 'B馬', (0, 2): 'B象',
-            (0, 3): 'B士', (0, 4): 'B將', (0, 5): 'B士',
-            (0, 6): 'B象', (0, 7): 'B馬', (0, 8): 'B車',
-            (2, 1): 'B炮', (2, 7): 'B炮',
-            (3, 0): 'B卒', (3, 2): 'B卒', (3, 4): 'B卒',
-            (3, 6): 'B卒', (3, 8): 'B卒'
+            (0, 0): BLACK | CHARIOT, (0, 1): BLACK | HORSE, (0, 2): BLACK | ELEPHANT,
+            (0, 3): BLACK | ADVISOR, (0, 4): BLACK | GENERAL, (0, 5): BLACK | ADVISOR,
+            (0, 6): BLACK | ELEPHANT, (0, 7): BLACK | HORSE, (0, 8): BLACK | CHARIOT,
+            (2, 1): BLACK | CANNON, (2, 7): BLACK | CANNON,
+            (3, 0): BLACK | PAWN, (3, 2): BLACK | PAWN, (3, 4): BLACK | PAWN,
+            (3, 6): BLACK | PAWN, (3, 8): BLACK | PAWN
         }
         
         # Place pieces on board
         for pos, piece in red_pieces.items():
             row, col = pos
-            self.board[row][col] = piece
+            self.board.add_piece(square(row, col), piece)
             
         for pos, piece in black_pieces.items():
             row, col = pos
-            self.board[row][col] = piece
+            self.board.add_piece(square(row, col), piece)
 
     def draw_board(self):
         # Clear canvas
@@ -896,13 +2493,14 @@ class ChineseChess:
         # Draw pieces on intersections
         for row in range(10):
             for col in range(9):
-                if self.board[row][col]:
+                piece = self.board.piece_at(row, col)
+                if piece:
                     # Calculate position on intersections
                     x = self.board_margin + col * self.cell_size
                     y = self.board_margin + row * self.cell_size
                     
                     # Draw piece circle
-                    color = 'red' if self.board[row][col][0] == 'R' else 'black'
+                    color = 'red' if piece & RED else 'black'
                     self.canvas.create_oval(
                         x - self.piece_radius, y - self.piece_radius,
                         x + self.piece_radius, y + self.piece_radius,
@@ -912,8 +2510,8 @@ class ChineseChess:
                     )
                     
                     # Draw piece text
-                    piece_text = self.board[row][col][1]
-                    text_color = 'red' if self.board[row][col][0] == 'R' else 'black'
+                    piece_text = PIECE_GLYPHS[piece]
+                    text_color = 'red' if piece & RED else 'black'
                     self.canvas.create_text(
                         x, y,
                         text=piece_text,
@@ -1008,6 +2606,8 @@ class ChineseChess:
         victory_window.wait_window()
 
     def restart_game(self):
+        self.cancel_ai_move()
+        
         # Store the current game's move history if it exists
         if self.move_history:
             self.game_history.append(self.move_history)
@@ -1020,6 +2620,7 @@ class ChineseChess:
         self.replay_mode = False
         self.current_replay_index = 0            
         self.game_over = False  # Add this line
+        self.searcher.clear()
                     
         # Set button states for normal gameplay
         self.set_button_states_for_gameplay()
@@ -1028,281 +2629,102 @@ class ChineseChess:
         self.initialize_board()
         self.draw_board()
 
-    # Add piece movement validation(8 functions)
-
-    def is_valid_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        piece = self.board[from_row][from_col]
-        
-        # Basic validation
-        if not (0 <= to_row < 10 and 0 <= to_col < 9):
-            return False
-            
-        # Can't capture own pieces
-        if self.board[to_row][to_col] and self.board[to_row][to_col][0] == piece[0]:
-            return False
-        
-        # Get piece type (second character of the piece string)
-        piece_type = piece[1]
-        
-        # Check specific piece movement rules
-        if piece_type == '帥' or piece_type == '將':  # General/King
-            return self.is_valid_general_move(from_pos, to_pos)
-        elif piece_type == '仕' or piece_type == '士':  # Advisor
-            return self.is_valid_advisor_move(from_pos, to_pos)
-        elif piece_type == '相' or piece_type == '象':  # Elephant
-            return self.is_valid_elephant_move(from_pos, to_pos)
-        elif piece_type == '馬':  # Horse
-            return self.is_valid_horse_move(from_pos, to_pos)
-        elif piece_type == '車':  # Chariot
-            return self.is_valid_chariot_move(from_pos, to_pos)
-        elif piece_type == '炮':  # Cannon
-            return self.is_valid_cannon_move(from_pos, to_pos)
-        elif piece_type == '兵' or piece_type == '卒':  # Pawn
-            return self.is_valid_pawn_move(from_pos, to_pos)
-        
-        return False
-
-    def is_valid_general_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        piece = self.board[from_row][from_col]
-        
-        # Check if move is within palace (3x3 grid)
-        if piece[0] == 'R':  # Red general
-            if not (7 <= to_row <= 9 and 3 <= to_col <= 5):
-                return False
-        else:  # Black general
-            if not (0 <= to_row <= 2 and 3 <= to_col <= 5):
-                return False
-        
-        # Can only move one step horizontally or vertically
-        if abs(to_row - from_row) + abs(to_col - from_col) != 1:
-            return False
-            
-        return True
-
-    def is_valid_advisor_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        piece = self.board[from_row][from_col]
-        
-        # Check if move is within palace
-        if piece[0] == 'R':  # Red advisor
-            if not (7 <= to_row <= 9 and 3 <= to_col <= 5):
-                return False
-        else:  # Black advisor
-            if not (0 <= to_row <= 2 and 3 <= to_col <= 5):
-                return False
-        
-        # Must move exactly one step diagonally
-        if abs(to_row - from_row) != 1 or abs(to_col - from_col) != 1:
-            return False
-            
-        return True
-
-    def is_valid_elephant_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        piece = self.board[from_row][from_col]
-        
-        # Cannot cross river
-        if piece[0] == 'R':  # Red elephant
-            if to_row < 5:  # Cannot cross river
-                return False
-        else:  # Black elephant
-            if to_row > 4:  # Cannot cross river
-                return False
-        
-        # Must move exactly two steps diagonally
-        if abs(to_row - from_row) != 2 or abs(to_col - from_col) != 2:
-            return False
-        
-        # Check if there's a piece blocking the elephant's path
-        blocking_row = (from_row + to_row) // 2
-        blocking_col = (from_col + to_col) // 2
-        if self.board[blocking_row][blocking_col]:
-            return False
-            
-        return True
-
-    def is_valid_horse_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        
-        # Must move in an L-shape (2 steps in one direction, 1 step in perpendicular direction)
-        row_diff = abs(to_row - from_row)
-        col_diff = abs(to_col - from_col)
-        if not ((row_diff == 2 and col_diff == 1) or (row_diff == 1 and col_diff == 2)):
-            return False
-        
-        # Check for blocking piece
-        if row_diff == 2:
-            blocking_row = from_row + (1 if to_row > from_row else -1)
-            if self.board[blocking_row][from_col]:
-                return False
-        else:
-            blocking_col = from_col + (1 if to_col > from_col else -1)
-            if self.board[from_row][blocking_col]:
-                return False
-                
-        return True
-
-    def is_valid_chariot_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        
-        # Must move horizontally or vertically
-        if from_row != to_row and from_col != to_col:
-            return False
-        
-        # Check if path is clear
-        if from_row == to_row:  # Horizontal move
-            start_col = min(from_col, to_col) + 1
-            end_col = max(from_col, to_col)
-            for col in range(start_col, end_col):
-                if self.board[from_row][col]:
-                    return False
-        else:  # Vertical move
-            start_row = min(from_row, to_row) + 1
-            end_row = max(from_row, to_row)
-            for row in range(start_row, end_row):
-                if self.board[row][from_col]:
-                    return False
-                    
-        return True
+    def run(self):
+        self.window.mainloop()
 
-    def is_valid_cannon_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        
-        # Must move horizontally or vertically
-        if from_row != to_row and from_col != to_col:
-            return False
-        
-        # Count pieces between from and to positions
-        pieces_between = 0
-        if from_row == to_row:  # Horizontal move
-            start_col = min(from_col, to_col) + 1
-            end_col = max(from_col, to_col)
-            for col in range(start_col, end_col):
-                if self.board[from_row][col]:
-                    pieces_between += 1
-        else:  # Vertical move
-            start_row = min(from_row, to_row) + 1
-            end_row = max(from_row, to_row)
-            for row in range(start_row, end_row):
-                if self.board[row][from_col]:
-                    pieces_between += 1
-        
-        # If capturing, need exactly one piece between
-        if self.board[to_row][to_col]:
-            return pieces_between == 1
-        # If not capturing, path must be clear
-        return pieces_between == 0
-
-    def is_valid_pawn_move(self, from_pos, to_pos):
-        from_row, from_col = from_pos
-        to_row, to_col = to_pos
-        piece = self.board[from_row][from_col]
-        
-        if piece[0] == 'R':  # Red pawn
-            # Before crossing river
-            if from_row > 4:
-                # Can only move forward (up)
-                return to_col == from_col and to_row == from_row - 1
-            # After crossing river
+# Perft test positions as (FEN, {depth: leaf nodes}).
+# The start position counts are the published xiangqi reference values; the
+# others were recorded from this generator after cross-checking depths 1-3
+# against a brute-force make/is_in_check count.
+PERFT_POSITIONS = [
+    (START_FEN, {1: 44, 2: 1920, 3: 79666, 4: 3290240, 5: 133312995}),
+    ('r1ba1a3/4kn3/2n1b4/pNp1p1p1p/4c4/6P2/P1P2R2P/1CcC5/9/2BAKAB2 w - - 0 1',
+     {1: 38, 2: 1128, 3: 43929, 4: 1339047}),
+    ('1cbak4/9/n2a5/2p1p3p/5cp2/2n2N3/6PCP/3AB4/2C6/3A1K1N1 w - - 0 1',
+     {1: 7, 2: 281, 3: 8620, 4: 326201}),
+    ('3k5/4a4/9/9/2c6/9/9/9/4C4/4KR3 b - - 0 1',
+     {1: 21, 2: 528, 3: 10019, 4: 276911}),
+    ('2bak4/4a4/4b4/9/2pN5/9/2P1c4/4B4/4A4/3AK1R2 b - - 0 1',
+     {1: 17, 2: 345, 3: 6045, 4: 138544}),
+]
+
+
+def run_perft_suite(max_depth=3, positions=PERFT_POSITIONS):
+    """
+    Run perft on each test position up to max_depth, printing nodes and nodes per
+    second. Returns True if every count matches its reference value.
+    """
+    all_passed = True
+    for fen, expected_counts in positions:
+        print(fen)
+        board = Board.from_fen(fen)
+        for depth in range(1, max_depth + 1):
+            start_time = time.time()
+            nodes = board.perft(depth)
+            elapsed = time.time() - start_time
+            expected = expected_counts.get(depth)
+            if expected is None:
+                status = ''
+            elif nodes == expected:
+                status = 'ok'
             else:
-                # Can move forward or sideways
-                return (to_col == from_col and to_row == from_row - 1) or \
-                       (to_row == from_row and abs(to_col - from_col) == 1)
-        else:  # Black pawn
-            # Before crossing river
-            if from_row < 5:
-                # Can only move forward (down)
-                return to_col == from_col and to_row == from_row + 1
-            # After crossing river
-            else:
-                # Can move forward or sideways
-                return (to_col == from_col and to_row == from_row + 1) or \
-                       (to_row == from_row and abs(to_col - from_col) == 1)
-
-    # the following 3 functions (conbined with on_click function) is to add the CHECK feature
-    def find_kings(self):
-        """Find positions of both kings/generals"""
-        red_king_pos = black_king_pos = None
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece:
-                    if piece[1] == '帥':
-                        red_king_pos = (row, col)
-                    elif piece[1] == '將':
-                        black_king_pos = (row, col)
-        return red_king_pos, black_king_pos
+                status = f'FAIL (expected {expected})'
+                all_passed = False
+            nps = nodes / elapsed if elapsed > 0 else 0
+            print(f"  depth {depth}: {nodes:>12} nodes  {elapsed:8.2f}s  {nps:>10.0f} nps  {status}")
+    return all_passed
+
+
+def print_divide(depth, fen=START_FEN):
+    """Print the perft count below each root move, sorted by move notation"""
+    if depth < 1:
+        raise ValueError(f"divide depth must be at least 1, got {depth}")
+    board = Board.from_fen(fen)
+    counts = board.divide(depth)
+    for move in sorted(counts, key=move_notation):
+        print(f"{move_notation(move)}: {counts[move]}")
+    print(f"Moves: {len(counts)}  Nodes: {sum(counts.values())}")
+
+
+def depth_argument(args, default=None):
+    """Depth given as the first command line argument after an option; exits with a message unless it is at least 1"""
+    if not args and default is not None:
+        return default
+    try:
+        depth = int(args[0])
+    except (IndexError, ValueError):
+        depth = 0
+    if depth < 1:
+        sys.exit(f"Depth must be an integer of at least 1, got {args[0] if args else 'none'}")
+    return depth
 
-    def is_position_under_attack(self, pos, attacking_color):
-        """Check if a position is under attack by pieces of the given color"""
-        target_row, target_col = pos
-        
-        # Check from all positions on the board
-        for row in range(10):
-            for col in range(9):
-                piece = self.board[row][col]
-                if piece and piece[0] == attacking_color[0].upper():
-                    # Check if this piece can move to the target position
-                    if self.is_valid_move((row, col), pos):
-                        return True
-        return False  
-
-    def is_generals_facing(self):
-        """Check if the two generals are facing each other directly"""
-        red_king_pos, black_king_pos = self.find_kings()
-        
-        # If either king is missing, return False
-        if not red_king_pos or not black_king_pos:
-            return False
-            
-        red_row, red_col = red_king_pos
-        black_row, black_col = black_king_pos
-        
-        # Check if generals are in the same column
-        if red_col != black_col:
-            return False
-            
-        # Check if there are any pieces between the generals
-        start_row = min(red_row, black_row) + 1
-        end_row = max(red_row, black_row)
-        
-        for row in range(start_row, end_row):
-            if self.board[row][red_col]:  # If there's any piece between
-                return False
-                
-        # If we get here, the generals are facing each other
-        return True
-
-    def is_in_check(self, color):
-        """Check if the king of the given color is in check"""
-        red_king_pos, black_king_pos = self.find_kings()
-        
-        if not red_king_pos or not black_king_pos:
-            return False
-        
-        # First check the special case of facing generals
-        if self.is_generals_facing():
-            return True  # Both kings are in check in this case
-        
-        # Then check the normal cases of being under attack
-        if color == 'red':
-            return self.is_position_under_attack(red_king_pos, 'black')
-        else:
-            return self.is_position_under_attack(black_king_pos, 'red')
-
-    def run(self):
-        self.window.mainloop()
 
 # Create and run the game
 if __name__ == "__main__":
+    if '--check-movegen' in sys.argv:
+        # Verify the move generator against is_valid_move and exit
+        mismatches = check_move_generator()
+        print(f"Move generator mismatches: {mismatches}")
+        sys.exit(1 if mismatches else 0)
+    if '--check-attacks' in sys.argv:
+        # Verify attack/check detection against the full scan and exit
+        mismatches = check_attack_detection()
+        print(f"Attack detection mismatches: {mismatches}")
+        sys.exit(1 if mismatches else 0)
+    if '--check-legal' in sys.argv:
+        # Verify legal move generation against make/verify and exit
+        mismatches = check_legal_moves()
+        print(f"Legal move mismatches: {mismatches}")
+        sys.exit(1 if mismatches else 0)
+    if '--perft' in sys.argv:
+        # Run the perft suite and exit: --perft [max_depth]
+        args = sys.argv[sys.argv.index('--perft') + 1:]
+        max_depth = depth_argument(args, 3)
+        sys.exit(0 if run_perft_suite(max_depth) else 1)
+    if '--divide' in sys.argv:
+        # Print perft per root move and exit: --divide depth [FEN]
+        args = sys.argv[sys.argv.index('--divide') + 1:]
+        print_divide(depth_argument(args), ' '.join(args[1:]) or START_FEN)
+        sys.exit(0)
     game = ChineseChess()
     game.run()
\ No newline at end of file